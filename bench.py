@@ -0,0 +1,193 @@
+"""
+    File: Compiler Design Benchmarks
+    Description: Times the parser on generated formulas of controlled depth, width, predicate arity and
+                 signature size. parse_file, PredictiveParser.parse and print_graph are timed separately.
+    Usage: python bench.py [--output results.json] [--baseline baseline.json] [--threshold 0.25]
+
+    Results are written as JSON. Save a run as the baseline and pass it with --baseline on later runs,
+    any timing more than threshold slower than the baseline is reported and the exit code is 1.
+    print_graph needs matplotlib, networkx and pygraphviz and is only timed for small trees.
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import argparse
+import platform
+import tempfile
+
+from test import gen_sub, BASE_VAR, BASE_CONST, BASE_PRED, BASE_EQ, BASE_CONN, BASE_QUAN, BASE_FORMULA
+import submission
+
+GRAPH_LIMIT = 2000 # Largest tree in nodes print_graph is timed on, drawing is very slow beyond that
+
+# Each case generates one input file, width is the number of subformulas joined at each level
+# Width 1 nests unary connectives and quantifiers instead, signature is the number of extra symbols
+CASES = [
+    {'name': "base", 'depth': 0, 'width': 2, 'arity': 1, 'signature': 0},
+    {'name': "balanced", 'depth': 12, 'width': 2, 'arity': 2, 'signature': 0},
+    {'name': "wide", 'depth': 2, 'width': 100, 'arity': 2, 'signature': 0},
+    {'name': "deep", 'depth': 20000, 'width': 1, 'arity': 1, 'signature': 0},
+    {'name': "arity", 'depth': 6, 'width': 2, 'arity': 200, 'signature': 0},
+    {'name': "signature", 'depth': 6, 'width': 2, 'arity': 2, 'signature': 20000},
+]
+
+# Function to build the signature and substitution dictionary for a case
+# Starts from gen_sub and adds the predicate of the requested arity and any extra symbols
+def gen_signature(case):
+    sub_dict = gen_sub(sub=False)
+    signature = {"variables": list(BASE_VAR), "constants": list(BASE_CONST), "predicates": list(BASE_PRED),
+                 "equality": list(BASE_EQ), "connectives": list(BASE_CONN), "quantifiers": list(BASE_QUAN)}
+
+    pred = "PREDN"
+    sub_dict[pred] = (pred, f"{pred}[{case['arity']}]")
+    signature["predicates"].append(pred)
+
+    # Extra symbols only grow the signature, the formula never uses them
+    for i in range(case['signature']):
+        field, prefix = [("variables", "XVAR"), ("constants", "XCONST"), ("predicates", "XPRED")][i % 3]
+        symbol = f"{prefix}{i}"
+        sub_dict[symbol] = (symbol, f"{symbol}[{i % 5 + 1}]") if field == "predicates" else symbol
+        signature[field].append(symbol)
+    return signature, sub_dict
+
+# Function to generate a formula of the given depth out of the base formulas and predicates of the given arity
+def gen_formula(depth, width, arity):
+    if depth == 0:
+        if random.random() < 0.5:
+            return list(random.choice(BASE_FORMULA))
+        args = [random.choice(BASE_VAR) for _ in range(arity)]
+        return ["PREDN", "("] + ' , '.join(args).split() + [")"]
+
+    if width == 1:
+        # Build deep chains iteratively so the generator does not hit the recursion limit
+        prefix = []
+        for _ in range(depth):
+            prefix += random.choice([["NEG"], [random.choice(["EXISTS", "FORALL"]), random.choice(BASE_VAR)]])
+        return prefix + gen_formula(0, width, arity)
+
+    formula = gen_formula(depth - 1, width, arity)
+    for _ in range(width - 1):
+        formula = ["("] + formula + [random.choice(["AND", "OR", "IMPLIES", "IFF"])] + gen_formula(depth - 1, width, arity) + [")"]
+    return formula
+
+# Function to write an input file, in the same format as write_to_file in test.py
+def write_input(path, formula, signature, sub_dict):
+    f = open(path, mode='w')
+    for field, symbols in signature.items():
+        if field == "predicates":
+            f.write(f"{field}: {' '.join(sub_dict[x][1] for x in symbols)}\n")
+        else:
+            f.write(f"{field}: {' '.join(sub_dict[x] for x in symbols)}\n")
+    f.write(f"formula: {' '.join(sub_dict[x][0] if type(sub_dict[x]) == tuple else sub_dict[x] for x in formula)}\n")
+    f.close()
+
+# Returns the best time in seconds of repeat calls to fn
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Function to time one case, returns the result record for it
+def run_case(case, directory, repeat):
+    random.seed(case['name'])
+    signature, sub_dict = gen_signature(case)
+    formula = gen_formula(case['depth'], case['width'], case['arity'])
+    path = os.path.join(directory, f"{case['name']}.txt")
+    write_input(path, formula, signature, sub_dict)
+
+    result = dict(case, tokens=len(formula))
+    result['parse_file'] = best_time(lambda: submission.parse_file(path, submission.PredictiveParser()), repeat)
+
+    parser = submission.PredictiveParser()
+    if not submission.parse_file(path, parser) == "OK":
+        raise ValueError(f"Generated input for {case['name']} has an invalid signature")
+    tokens = list(submission.formula_tokens(parser))
+    result['parse'] = best_time(lambda: parser.parse(tokens), repeat)
+    if parser.parse(tokens):
+        raise ValueError(f"Generated formula for {case['name']} is invalid: {parser.syntax_code} at {parser.index}")
+    result['nodes'] = len(parser.tree)
+
+    result['print_graph'] = None
+    if result['nodes'] <= GRAPH_LIMIT:
+        try:
+            import matplotlib
+            matplotlib.use("Agg")
+            import matplotlib.pyplot as plt
+            # print_graph also needs these, a missing one skips the timing instead of failing the run
+            import networkx
+            import pygraphviz
+        except ImportError:
+            return result # The plotting libraries are optional
+        def draw():
+            parser.print_graph()
+            plt.close('all')
+        result['print_graph'] = best_time(draw, repeat)
+    return result
+
+# Function to compare results with a baseline, returns a list of messages for the slowdowns
+def compare(results, baseline, threshold):
+    regressions = []
+    old_cases = {case['name']: case for case in baseline['cases']}
+    for case in results['cases']:
+        old = old_cases.get(case['name'])
+        if old is None:
+            continue
+        for timing in ['parse_file', 'parse', 'print_graph']:
+            if case[timing] is None or old.get(timing) is None:
+                continue
+            ratio = case[timing] / old[timing]
+            if ratio > 1 + threshold:
+                regressions.append(f"{case['name']}.{timing}: {old[timing]:.4f}s -> {case[timing]:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the formula parser on generated inputs.")
+    arg_parser.add_argument('--output', default="bench.json", help="File to write the results to (default: bench.json)")
+    arg_parser.add_argument('--baseline', help="Results of an earlier run to compare against")
+    arg_parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed slowdown relative to the baseline before failing (default: 0.25)")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="Runs of each timing, the best is kept (default: 3)")
+    arg_parser.add_argument('--case', action='append', help="Only run the named case, may be given more than once")
+    args = arg_parser.parse_args()
+
+    results = {'python': platform.python_version(), 'machine': platform.machine(), 'cases': []}
+    with tempfile.TemporaryDirectory() as directory:
+        # print_graph and print_productions write into the working directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for case in CASES:
+                if args.case and not case['name'] in args.case:
+                    continue
+                result = run_case(case, directory, args.repeat)
+                results['cases'].append(result)
+                graph = "-" if result['print_graph'] is None else f"{result['print_graph']:.4f}s"
+                print(f"{case['name']:>10}: {result['tokens']:>8} tokens  parse_file {result['parse_file']:.4f}s  "
+                      f"parse {result['parse']:.4f}s  print_graph {graph}")
+        finally:
+            os.chdir(cwd)
+
+    f = open(args.output, mode='w')
+    json.dump(results, f, indent=4)
+    f.close()
+
+    if args.baseline:
+        f = open(args.baseline, mode='r')
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"SLOWER:\t{message}")
+        if regressions:
+            sys.exit(1)
+        print("INFO:\tNo slowdowns compared to the baseline")
+
+if __name__ == '__main__':
+    main()
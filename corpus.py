@@ -0,0 +1,214 @@
+"""
+    File: Compiler Design Parse Tree Corpus
+    Description: Compact binary files of parse trees, written once and read back through a memory map.
+    Usage: with CorpusWriter("trees.bin", parser.tokens) as writer:
+               writer.write(parser.tree)
+           with Corpus("trees.bin") as corpus:
+               tree = corpus[i]
+
+    A corpus holds any number of trees over one signature. The file starts with the symbol table, the tokens
+    of the signature in the order of their ids. Each tree follows as three flat arrays in preorder: the kind of
+    every node (one byte, TERMINAL for tokens), its token id (-1 for nonterminals) and the number of nodes in its
+    subtree, so the children of a node are found by skipping over the subtrees before them. An index of tree
+    offsets and a trailer end the file. All numbers are little endian and arrays are aligned to their size.
+
+    Reading a tree copies nothing, a StoredTree is a set of views into the mapped file. It has the same
+    interface as ParseTree (root, kind, token, tokens, children, label, preorder), so write_dot, evaluate.py and
+    normalform.py work on it directly without reparsing.
+"""
+
+import sys
+import mmap
+import struct
+from array import array
+
+from submission import ParseTree
+
+MAGIC = b"FOLTREE\0"
+VERSION = 1
+HEADER = struct.Struct("<8sII") # Magic, version, number of symbols
+TREE_HEADER = struct.Struct("<II") # Number of nodes, unused
+TRAILER = struct.Struct("<QQ8s") # Offset of the index, number of trees, magic
+LITTLE = sys.byteorder == 'little' # Arrays are viewed in place on little endian machines, copied otherwise
+
+# Writes parse trees of one signature to a corpus file
+# tokens is the symbol table the trees index into, normally parser.tokens
+class CorpusWriter:
+    def __init__(self, path, tokens):
+        self.tokens = tuple(tokens)
+        self.offsets = array('Q') # File offset of each tree written
+        self.file = open(path, mode='wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(tokens)))
+        for token in tokens:
+            data = token.encode()
+            self.file.write(struct.pack("<I", len(data)) + data)
+        self.pad(8)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Pads the file with zero bytes to a multiple of size
+    def pad(self, size):
+        self.file.write(bytes(-self.file.tell() % size))
+
+    # Appends a ParseTree, SharedTree or StoredTree, DAGs are written out as trees
+    def write(self, tree):
+        if not (tree.tokens is self.tokens or tuple(tree.tokens) == self.tokens):
+            raise ValueError("Tree is over a different signature than the corpus")
+        kind, token, size = preorder_columns(tree)
+        self.offsets.append(self.file.tell())
+        self.file.write(TREE_HEADER.pack(len(kind), 0))
+        self.file.write(kind.tobytes())
+        self.pad(4)
+        for column in (token, size):
+            if not LITTLE:
+                column.byteswap()
+            self.file.write(column.tobytes())
+        self.pad(8)
+
+    # Writes the index and trailer and closes the file
+    def close(self):
+        if self.file.closed:
+            return
+        index = self.file.tell()
+        offsets = array('Q', self.offsets)
+        if not LITTLE:
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.write(TRAILER.pack(index, len(self.offsets), MAGIC))
+        self.file.close()
+
+# Function to get the kind, token and subtree size columns of a tree in preorder
+def preorder_columns(tree):
+    if type(tree) is ParseTree and tree.garbage == 0:
+        # Nodes are added in preorder, so the columns can be used as they are
+        kind, token, parent = tree.kind, tree.token, tree.parent
+    elif type(tree) is StoredTree:
+        return array('B', tree.kind), array('i', tree.token), array('i', tree.size)
+    else:
+        kind, token, parent = array('B'), array('i'), array('i')
+        stack = [(tree.root, -1)]
+        while stack:
+            node, up = stack.pop()
+            parent.append(up)
+            up = len(kind)
+            kind.append(tree.kind[node])
+            token.append(tree.token[node])
+            stack.extend((child, up) for child in reversed(list(tree.children(node))))
+    # Children always come after their parent so one reverse pass adds up the subtree sizes
+    size = array('i', [1]) * len(kind)
+    for node in range(len(kind) - 1, 0, -1):
+        size[parent[node]] += size[node]
+    return array('B', kind), array('i', token), size
+
+# A parse tree read from a corpus, its columns are views into the mapped file
+class StoredTree:
+    LABELS = ParseTree.LABELS
+    KINDS = ParseTree.KINDS
+    TERMINAL = ParseTree.TERMINAL
+    root = 0
+
+    def __init__(self, tokens, kind, token, size):
+        self.tokens = tokens # Symbol table of the corpus
+        self.kind = kind
+        self.token = token
+        self.size = size # Number of nodes in the subtree of each node
+
+    def __len__(self):
+        return len(self.kind)
+
+    # Yields the children of node from left to right
+    def children(self, node):
+        child = node + 1
+        end = node + self.size[node]
+        while child < end:
+            yield child
+            child += self.size[child]
+
+    # The label of a node, either the production name or the terminal token
+    def label(self, node):
+        kind = self.kind[node]
+        if kind == self.TERMINAL:
+            return self.tokens[self.token[node]]
+        return self.LABELS[kind]
+
+    # The nodes under node (the whole tree by default) in preorder, which is the order they are stored in
+    def preorder(self, node=None):
+        node = self.root if node is None else node
+        return iter(range(node, node + self.size[node]))
+
+# Reads a corpus file written by CorpusWriter through a memory map
+# The trees it returns are views into the map, trees still in use when the corpus is closed keep it mapped
+class Corpus:
+    def __init__(self, path):
+        with open(path, mode='rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.map)
+        if len(self.data) < HEADER.size + TRAILER.size:
+            raise ValueError("Not a parse tree corpus, the file is too short")
+        magic, version, count = HEADER.unpack_from(self.data, 0)
+        index, trees, end_magic = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if not magic == MAGIC or not end_magic == MAGIC:
+            raise ValueError("Not a parse tree corpus, or the file was not closed")
+        if not version == VERSION:
+            raise ValueError(f"Unsupported corpus version {version}")
+
+        # The symbol table is decoded once, every tree shares it
+        tokens = []
+        position = HEADER.size
+        for _ in range(count):
+            length, = struct.unpack_from("<I", self.data, position)
+            position += 4
+            tokens.append(bytes(self.data[position:position + length]).decode())
+            position += length
+        self.tokens = tuple(tokens) # A tuple, like the tokens of a Grammar
+        self.offsets = self.column(index, trees, 'Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        offset = self.offsets[i]
+        n, _ = TREE_HEADER.unpack_from(self.data, offset)
+        kind = self.data[offset + TREE_HEADER.size:offset + TREE_HEADER.size + n]
+        position = offset + TREE_HEADER.size + n + (-n % 4)
+        token = self.column(position, n, 'i')
+        size = self.column(position + 4 * n, n, 'i')
+        return StoredTree(self.tokens, kind, token, size)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # View of count numbers of the typecode starting at offset, copied only on big endian machines
+    def column(self, offset, count, typecode):
+        view = self.data[offset:offset + count * struct.calcsize(typecode)]
+        if LITTLE:
+            return view.cast(typecode)
+        column = array(typecode, bytes(view))
+        column.byteswap()
+        return column
+
+    # Releases the map, or leaves it to the trees read from it when some are still in use
+    def close(self):
+        if self.map is None:
+            return
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.data.release()
+        try:
+            self.map.close()
+        except BufferError: # Views of live trees hold the map, it is unmapped once the last of them is freed
+            pass
+        self.map = self.data = self.offsets = None
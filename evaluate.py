@@ -0,0 +1,192 @@
+"""
+    File: Compiler Design Finite Model Evaluator
+    Description: Evaluates formulas accepted by the parser over finite interpretations with NumPy.
+    Usage: formula = compile_formula(parser)
+           formula.evaluate(Model(size, predicates, constants))
+
+    The domain is the integers 0 to size - 1. Each predicate of arity k is a boolean array of shape (size,) * k,
+    indexed by its arguments in order, and each constant is an element of the domain.
+    Connectives and quantifiers are read in the order of the input file: connectives2 are and, or, implies, iff
+    (negation is the last connective) and the quantifiers are exists, forall.
+
+    Every variable name gets its own array axis, so each subformula is a boolean array over the variables it
+    mentions, broadcast over the rest, and quantifiers reduce along the axis of their variable. A formula is checked
+    with whole-array NumPy operations instead of looping over the size ** k assignments in Python.
+    numpy is only needed by this module, the parser itself does not use it.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from submission import ParseTree, CONNECTIVE_MEANINGS, QUANTIFIER_MEANINGS
+
+KINDS = ParseTree.KINDS
+
+# Interpretation of the signature over the domain 0 to size - 1
+# predicates maps each predicate name to a boolean array, constants maps each constant to a domain element
+class Model:
+    def __init__(self, size, predicates, constants):
+        self.size = size
+        self.predicates = {name: np.asarray(value, dtype=bool) for name, value in predicates.items()}
+        self.constants = dict(constants)
+
+    # Interpretation of a predicate applied to arity arguments
+    def predicate(self, name, arity):
+        if not name in self.predicates:
+            raise ValueError(f"Model has no interpretation for predicate {name}")
+        value = self.predicates[name]
+        if not value.shape == (self.size,) * arity:
+            raise ValueError(f"Predicate {name} has shape {value.shape}, expected {(self.size,) * arity}")
+        return value
+
+    # Domain element of a constant
+    def constant(self, name):
+        if not name in self.constants:
+            raise ValueError(f"Model has no interpretation for constant {name}")
+        value = self.constants[name]
+        if not 0 <= value < self.size:
+            raise ValueError(f"Constant {name} is {value}, outside the domain of size {self.size}")
+        return value
+
+# A parsed formula compiled to a postfix program that can be evaluated over many models
+# Instructions are tuples, run in order on a stack of boolean arrays
+#   ('bind', var)                 a quantifier's scope starts
+#   ('quantify', meaning, var)    reduce the top of the stack along the axis of var and end its scope
+#   ('pred', name, vars)          push a predicate applied to variables
+#   ('eq', term, term)            push an equality, terms are ('var' or 'const', name)
+#   ('not',)                      negate the top of the stack
+#   ('conn2', meaning)            combine the top two entries
+class Formula:
+    def __init__(self, program):
+        self.program = program
+        self.free = [] # Free variables in order of first occurrence, one axis each in the result
+        bound = defaultdict(int) # Quantifiers binding each variable around the current instruction
+        for instruction in program:
+            if instruction[0] == 'bind':
+                bound[instruction[1]] += 1
+            elif instruction[0] == 'quantify':
+                bound[instruction[2]] -= 1
+            elif instruction[0] in ('pred', 'eq'):
+                names = instruction[2] if instruction[0] == 'pred' else [t[1] for t in instruction[1:] if t[0] == 'var']
+                for name in names:
+                    if not bound[name] and not name in self.free:
+                        self.free.append(name)
+        # Variables that are only ever quantified, one axis each after those of self.free
+        self.bound = list(dict.fromkeys(x[1] for x in program if x[0] == 'bind' and not x[1] in self.free))
+
+    # Evaluates the formula in model
+    # Returns a boolean array with one axis of length model.size per free variable, in the order of self.free
+    # A formula without free variables gives a 0-dimensional array, use bool() on it
+    def evaluate(self, model):
+        n = model.size
+        free = len(self.free)
+        ndim = free + len(self.bound)
+        # One axis per variable name, a quantifier binding a name again reuses its axis. Its reduction leaves the
+        # axis with length 1, so the outer meaning of the name is broadcast back in when the scopes are combined
+        axes = {name: axis for axis, name in enumerate(self.free + self.bound)}
+        aranges = {} # Domain laid along each axis, shape n there and 1 elsewhere
+
+        def domain(name):
+            axis = axes[name]
+            if not axis in aranges:
+                shape = [1] * ndim
+                shape[axis] = n
+                aranges[axis] = np.arange(n).reshape(shape)
+            return aranges[axis]
+
+        def term(kind, name):
+            return domain(name) if kind == 'var' else np.full([1] * ndim, model.constant(name))
+
+        stack = []
+        for instruction in self.program:
+            op = instruction[0]
+            if op == 'pred':
+                _, name, args = instruction
+                value = model.predicate(name, len(args))
+                if len(set(args)) == len(args):
+                    # Distinct variables, the array is a view with its axes moved into place
+                    order = [axes[x] for x in args]
+                    shape = [1] * ndim
+                    for axis in order:
+                        shape[axis] = n
+                    value = value.transpose(np.argsort(order)).reshape(shape)
+                else:
+                    # A repeated variable reads along a diagonal, gather with broadcast indices
+                    value = value[tuple(domain(x) for x in args)]
+                stack.append(value)
+            elif op == 'eq':
+                stack.append(term(*instruction[1]) == term(*instruction[2]))
+            elif op == 'not':
+                stack.append(~stack.pop())
+            elif op == 'conn2':
+                right = stack.pop()
+                left = stack.pop()
+                if instruction[1] == 'and':
+                    stack.append(left & right)
+                elif instruction[1] == 'or':
+                    stack.append(left | right)
+                elif instruction[1] == 'implies':
+                    stack.append(~left | right)
+                else:
+                    stack.append(left == right)
+            elif op == 'quantify':
+                _, meaning, name = instruction
+                reduce = np.any if meaning == 'exists' else np.all
+                stack.append(reduce(stack.pop(), axis=axes[name], keepdims=True))
+
+        # Quantifier axes are all reduced to length 1, drop them
+        value = np.broadcast_to(stack.pop(), (n,) * free + (1,) * len(self.bound))
+        return value.reshape((n,) * free).copy()
+
+# Function to compile the parse tree of a valid formula into a Formula
+# tree defaults to the tree of the last parse, built with build_tree (a ParseTree or SharedTree)
+def compile_formula(parser, tree=None):
+    tree = parser.tree if tree is None else tree
+    if tree is None:
+        raise ValueError("No parse tree, parse a valid formula with build_tree first")
+    connectives2 = dict(zip(parser.symbols['connectives2'], CONNECTIVE_MEANINGS))
+    quantifiers = dict(zip(parser.symbols['quantifiers'], QUANTIFIER_MEANINGS))
+
+    # Token of a terminal node, or of the terminal under a var or const node
+    def token(node):
+        while not tree.kind[node] == tree.TERMINAL:
+            node = next(tree.children(node))
+        return tree.tokens[tree.token[node]]
+
+    program = []
+    stack = [(tree.root, False)] # (form node, children done), walked without recursion as formulas can be deep
+    while stack:
+        node, done = stack.pop()
+        children = list(tree.children(node))
+        head = tree.kind[children[0]]
+        if head == KINDS['quan']:
+            if done:
+                program.append(('quantify', quantifiers[token(children[0])], token(children[1])))
+            else:
+                program.append(('bind', token(children[1])))
+                stack.append((node, True))
+                stack.append((children[2], False))
+        elif head == KINDS['conn1']:
+            if done:
+                program.append(('not',))
+            else:
+                stack.append((node, True))
+                stack.append((children[1], False))
+        elif head == KINDS['pred']:
+            pred = list(tree.children(children[0]))
+            program.append(('pred', token(pred[0]), [token(x) for x in pred if tree.kind[x] == KINDS['var']]))
+        elif tree.kind[children[2]] == KINDS['eq']: # ( term eq term )
+            terms = [('var' if tree.kind[x] == KINDS['var'] else 'const', token(x)) for x in (children[1], children[3])]
+            program.append(('eq', *terms))
+        elif done: # ( form conn2 form )
+            program.append(('conn2', connectives2[token(children[2])]))
+        else:
+            stack.append((node, True))
+            stack.append((children[3], False))
+            stack.append((children[1], False))
+    return Formula(program)
+
+# Function to evaluate the formula last parsed by parser in model, see Formula.evaluate
+def evaluate(parser, model):
+    return compile_formula(parser).evaluate(model)
@@ -0,0 +1,337 @@
+"""
+    File: Compiler Design Clausal Normal Form
+    Description: Converts formulas accepted by the parser into clauses for a resolution or SAT style solver.
+    Usage: clauses = clausal_form(parser)
+           write_tptp(out, clauses)
+
+    The pipeline is negation normal form, renaming bound variables apart and Skolemization, which leaves the formula
+    in prenex form with only universal quantifiers, then clauses with definitional (Tseitin style) predicates.
+    Formulas are hash-consed in a FormulaStore, so each pass rewrites every distinct subformula once. Disjunctions
+    are never distributed over conjunctions, a conjunction inside a disjunction is named by a fresh predicate instead,
+    so the clauses and the time to build them stay linear in the size of the formula.
+    Connectives and quantifiers are read in the order of the input file, as in evaluate.py.
+
+    Terms are ('var', name), ('const', name) and ('fn', name, args) for Skolem functions.
+    A clause is a tuple of literals (positive, atom), an atom is ('pred', name, terms) or ('eq', term, term).
+"""
+
+from collections import defaultdict
+
+from submission import ParseTree, CONNECTIVE_MEANINGS, QUANTIFIER_MEANINGS
+
+KINDS = ParseTree.KINDS
+BINARY = ('and', 'or', 'implies', 'iff')
+QUANTIFIED = ('exists', 'forall')
+
+# Hash-consed formulas, identical subformulas share one id
+# Formulas are tuples of an operator and its operands, operand formulas are ids into nodes
+#   ('pred', name, terms), ('eq', term, term), ('not', a), (connective, a, b), (quantifier, var, a)
+class FormulaStore:
+    def __init__(self):
+        self.nodes = [] # Formula of each id
+        self.ids = {} # Formula -> id
+        self.free = {} # Memo for free_variables
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Returns the id of a formula, adding it if it is new
+    def make(self, *node):
+        id = self.ids.get(node)
+        if id is None:
+            id = len(self.nodes)
+            self.ids[node] = id
+            self.nodes.append(node)
+        return id
+
+    # Ids of the formulas a formula is built from
+    def operands(self, id):
+        node = self.nodes[id]
+        if node[0] == 'not':
+            return [node[1]]
+        if node[0] in BINARY:
+            return [node[1], node[2]]
+        if node[0] in QUANTIFIED:
+            return [node[2]]
+        return []
+
+    # Sorted tuple of the variables free in a formula
+    def free_variables(self, id):
+        def build(id, operands):
+            node = self.nodes[id]
+            if node[0] == 'pred':
+                names = term_variables(node[2])
+            elif node[0] == 'eq':
+                names = term_variables(node[1:])
+            elif node[0] in QUANTIFIED:
+                names = set(operands[0]) - {node[1]}
+            else:
+                names = set().union(*operands)
+            return tuple(sorted(names))
+        return memoised(id, self.operands, build, self.free)
+
+# Function to compute memo[key] for key and every key it depends on, without recursing as formulas can be deep
+# children(key) returns the keys it depends on and build(key, results) computes it from their results
+# Keys are expanded in preorder, the first child first
+def memoised(key, children, build, memo):
+    stack = [key]
+    pending = {} # Children of the keys that are expanded but not built yet
+    while stack:
+        key = stack[-1]
+        if key in memo:
+            stack.pop()
+        elif key in pending:
+            stack.pop()
+            memo[key] = build(key, [memo[child] for child in pending.pop(key)])
+        else:
+            pending[key] = children(key)
+            stack.extend(reversed(pending[key]))
+    return memo[key]
+
+# Set of the variable names in some terms
+def term_variables(terms):
+    names = set()
+    stack = list(terms)
+    while stack:
+        term = stack.pop()
+        if term[0] == 'var':
+            names.add(term[1])
+        elif term[0] == 'fn':
+            stack.extend(term[2])
+    return names
+
+# Function to make a generator of fresh names that clash with no symbol of the signature
+def fresh_names(parser):
+    used = set(parser.table)
+    counts = defaultdict(int)
+    def fresh(prefix):
+        while True:
+            counts[prefix] += 1
+            name = f"{prefix}{counts[prefix]}"
+            if not name in used:
+                used.add(name)
+                return name
+    return fresh
+
+# Function to add the formula of a parse tree to a store, returns the store and the id of the formula
+# tree defaults to the tree of the last parse (a ParseTree or SharedTree)
+def formula_store(parser, tree=None, store=None):
+    tree = parser.tree if tree is None else tree
+    if tree is None:
+        raise ValueError("No parse tree, parse a valid formula with build_tree first")
+    store = FormulaStore() if store is None else store
+    connectives2 = dict(zip(parser.symbols['connectives2'], CONNECTIVE_MEANINGS))
+    quantifiers = dict(zip(parser.symbols['quantifiers'], QUANTIFIER_MEANINGS))
+
+    # Token of a terminal node, or of the terminal under a var or const node
+    def token(node):
+        while not tree.kind[node] == tree.TERMINAL:
+            node = next(tree.children(node))
+        return tree.tokens[tree.token[node]]
+
+    def term(node):
+        return ('var' if tree.kind[node] == KINDS['var'] else 'const', token(node))
+
+    # Form nodes a form node is built from
+    def children(node):
+        children = list(tree.children(node))
+        head = tree.kind[children[0]]
+        if head == KINDS['quan']:
+            return [children[2]]
+        if head == KINDS['conn1']:
+            return [children[1]]
+        if head == KINDS['pred'] or tree.kind[children[2]] == KINDS['eq']:
+            return []
+        return [children[1], children[3]]
+
+    def build(node, operands):
+        children = list(tree.children(node))
+        head = tree.kind[children[0]]
+        if head == KINDS['quan']:
+            return store.make(quantifiers[token(children[0])], token(children[1]), operands[0])
+        if head == KINDS['conn1']:
+            return store.make('not', operands[0])
+        if head == KINDS['pred']:
+            pred = list(tree.children(children[0]))
+            return store.make('pred', token(pred[0]), tuple(term(x) for x in pred if tree.kind[x] == KINDS['var']))
+        if tree.kind[children[2]] == KINDS['eq']:
+            return store.make('eq', term(children[1]), term(children[3]))
+        return store.make(connectives2[token(children[2])], operands[0], operands[1])
+
+    return store, memoised(tree.root, children, build, {})
+
+# Function to convert a formula to negation normal form, returns the id of the new formula
+# Only and, or, quantifiers and negated atoms remain. Implications are rewritten with or and each iff becomes
+# two clauses, whose operands are the shared negated and unnegated forms of the originals
+def nnf(store, root):
+    def children(key):
+        id, positive = key
+        node = store.nodes[id]
+        if node[0] == 'not':
+            return [(node[1], not positive)]
+        if node[0] in ('and', 'or'):
+            return [(node[1], positive), (node[2], positive)]
+        if node[0] == 'implies':
+            return [(node[1], not positive), (node[2], positive)]
+        if node[0] == 'iff':
+            return [(node[1], True), (node[1], False), (node[2], True), (node[2], False)]
+        if node[0] in QUANTIFIED:
+            return [(node[2], positive)]
+        return []
+
+    def build(key, operands):
+        id, positive = key
+        node = store.nodes[id]
+        if node[0] in ('pred', 'eq'):
+            return id if positive else store.make('not', id)
+        if node[0] == 'not':
+            return operands[0]
+        if node[0] in ('and', 'or'):
+            op = node[0] if positive else ('or' if node[0] == 'and' else 'and')
+            return store.make(op, operands[0], operands[1])
+        if node[0] == 'implies':
+            return store.make('or' if positive else 'and', operands[0], operands[1])
+        if node[0] == 'iff':
+            a, not_a, b, not_b = operands
+            if positive: # (a -> b) and (b -> a)
+                return store.make('and', store.make('or', not_a, b), store.make('or', a, not_b))
+            return store.make('and', store.make('or', a, b), store.make('or', not_a, not_b))
+        op = node[0] if positive else ('forall' if node[0] == 'exists' else 'exists')
+        return store.make(op, node[1], operands[0])
+
+    return memoised((root, True), children, build, {})
+
+# Function to bring a formula in negation normal form into prenex form
+# Every quantifier gets a fresh variable name from fresh, so the quantifiers can all be moved to the front
+# With skolemize each existential variable is replaced by a Skolem term instead, a fresh constant or a function
+# of the universal variables it depends on, and only universal quantifiers remain
+# Returns the prefix, a list of (quantifier, variable) in order, and the id of the quantifier free matrix
+def prenex(store, root, fresh, skolemize=False):
+    # Keys are (id, terms bound to the free variables of the formula, in the order of free_variables)
+    prefix = []
+    binders = {} # Term bound by the quantifier of each key
+    free = store.free_variables
+
+    def child_key(id, env):
+        return (id, tuple(env[name] for name in free(id)))
+
+    def children(key):
+        id, terms = key
+        node = store.nodes[id]
+        env = dict(zip(free(id), terms))
+        if node[0] in QUANTIFIED:
+            if skolemize and node[0] == 'exists':
+                # The Skolem term depends on the universal variables bound to the free variables of the formula
+                args = sorted(term_variables(terms))
+                name = fresh("sk")
+                binders[key] = ('fn', name, tuple(('var', x) for x in args)) if args else ('const', name)
+            else:
+                name = fresh("X")
+                binders[key] = ('var', name)
+                prefix.append((node[0], name))
+            env[node[1]] = binders[key]
+        return [child_key(operand, env) for operand in store.operands(id)]
+
+    def build(key, operands):
+        id, terms = key
+        node = store.nodes[id]
+        env = dict(zip(free(id), terms))
+        substitute = lambda term: env[term[1]] if term[0] == 'var' else term
+        if node[0] == 'pred':
+            return store.make('pred', node[1], tuple(substitute(x) for x in node[2]))
+        if node[0] == 'eq':
+            return store.make('eq', substitute(node[1]), substitute(node[2]))
+        if node[0] == 'not':
+            return store.make('not', operands[0])
+        if node[0] in QUANTIFIED:
+            return operands[0]
+        return store.make(node[0], operands[0], operands[1])
+
+    # Free variables of the whole formula are implicitly universal, they are renamed like the bound ones
+    env = {}
+    for name in free(root):
+        env[name] = ('var', fresh("X"))
+        prefix.append(('forall', env[name][1]))
+    matrix = memoised(child_key(root, env), children, build, {})
+    return prefix, matrix
+
+# Function to turn a quantifier free formula in negation normal form into clauses
+# A conjunction under a disjunction is replaced by a fresh predicate d over its free variables
+# and the clauses (not d or C) are added for every clause C of the conjunction. This only needs the implication
+# in one direction, as d only appears positively. Each distinct conjunction is named once
+def clauses(store, matrix, fresh):
+    result = []
+    names = {} # Id of each conjunction named so far -> its literal
+    pending = [] # Named conjunctions whose clauses are not written yet
+
+    # Literal of a negated or unnegated atom
+    def literal(id):
+        node = store.nodes[id]
+        return (False, store.nodes[node[1]]) if node[0] == 'not' else (True, node)
+
+    # Yields the operands of nested op formulas, each distinct one once
+    def flatten(id, op):
+        stack = [id]
+        seen = set()
+        while stack:
+            id = stack.pop()
+            if id in seen:
+                continue
+            seen.add(id)
+            if store.nodes[id][0] == op:
+                stack.extend(reversed(store.operands(id)))
+            else:
+                yield id
+
+    # The clause of a formula that is not a conjunction
+    def clause(id):
+        literals = []
+        for operand in flatten(id, 'or'):
+            if not store.nodes[operand][0] == 'and':
+                literals.append(literal(operand))
+                continue
+            if not operand in names:
+                name = fresh("def")
+                names[operand] = (True, ('pred', name, tuple(('var', x) for x in store.free_variables(operand))))
+                pending.append(operand)
+            literals.append(names[operand])
+        return tuple(literals)
+
+    for id in flatten(matrix, 'and'):
+        result.append(clause(id))
+    while pending:
+        id = pending.pop()
+        positive, atom = names[id]
+        for operand in flatten(id, 'and'):
+            result.append(((False, atom),) + clause(operand))
+    return result
+
+# Function to convert the formula last parsed by parser (or tree) into clauses, see the module description
+# The result is equisatisfiable with the formula, its free variables are treated as universal
+def clausal_form(parser, tree=None):
+    fresh = fresh_names(parser)
+    store, root = formula_store(parser, tree)
+    _, matrix = prenex(store, nnf(store, root), fresh, skolemize=True)
+    return clauses(store, matrix, fresh)
+
+# Function to write clauses in the TPTP CNF format read by most first order provers
+# Symbols are written as quoted atoms so any token of the signature is accepted, variables are the fresh X names
+def write_tptp(out, clauses):
+    def quote(name):
+        return "'" + name.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+    def term(t):
+        if t[0] == 'var':
+            return t[1]
+        if t[0] == 'const':
+            return quote(t[1])
+        return f"{quote(t[1])}({','.join(map(term, t[2]))})"
+
+    def literal(positive, atom):
+        if atom[0] == 'eq':
+            return f"{term(atom[1])} {'=' if positive else '!='} {term(atom[2])}"
+        text = quote(atom[1]) + (f"({','.join(map(term, atom[2]))})" if atom[2] else "")
+        return text if positive else "~ " + text
+
+    for i, clause in enumerate(clauses):
+        out.write(f"cnf(c{i + 1}, axiom, ({' | '.join(literal(*x) for x in clause)})).\n")
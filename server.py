@@ -0,0 +1,221 @@
+"""
+    File: Compiler Design Validation Server
+    Description: Long running server that keeps compiled signatures in memory, so formulas are validated without
+                 starting a new process, importing the program or loading the signature again for each one.
+    Usage: python server.py [--host 127.0.0.1] [--port 8765] [--jobs 0] [--cache-dir DIR] [--parse-cache 4096] [--specialise]
+                            [--signatures 256]
+
+    Clients connect over TCP and send one JSON request per line. One JSON response per line is sent back for
+    each request, in the order the requests were sent, so a client may send many requests before reading.
+    Any "id" in a request is copied to its response.
+        {"op": "load", "path": "input.txt"}                   Load the signature of an input file on the server
+        {"op": "load", "text": "variables: x y\\n..."}        Load a signature sent as the text of an input file
+            -> {"status": "OK" or "FAIL", "message": what parse_file printed, "signature": hash}
+               with "result" for the formula as below if the input had one
+        {"op": "parse", "signature": hash, "formula": "..."}  Validate a formula, given as text or a list of tokens
+            -> {"status": "OK" or "ERROR", "code": syntax code, "position": position of the error}
+    A request that cannot be carried out is answered with {"status": "FAIL", "message": reason}.
+    Only the last --signatures signatures used are kept, parsing against one dropped since fails until it is loaded again.
+
+    Loading a signature and parsing formulas of more than POOL_TOKENS tokens run in worker processes. Shorter
+    formulas are parsed in the server itself, sending them to a worker would take longer than parsing them.
+"""
+
+import io
+import os
+import copy
+import json
+import asyncio
+import argparse
+from contextlib import redirect_stdout
+
+from submission import PredictiveParser, ParseCache, parse_file, tokenize_formula, check_formula
+
+POOL_TOKENS = 2000 # Formulas with more tokens than this are parsed in a worker process
+WINDOW = 64 # Requests of one client in progress at a time, its later lines are not read until one finishes
+MAX_LINE = 1 << 26 # Longest request line in bytes
+MAX_SIGNATURES = 256 # Signatures kept in memory by the server and by each worker, the least recently used are dropped
+
+class ValidationServer:
+    def __init__(self, executor=None, cache_dir=None, parse_cache=None, specialise=False, signatures=MAX_SIGNATURES):
+        self.executor = executor # Process pool for the heavy work, if None everything runs in the server
+        self.cache_dir = cache_dir # Compiled signature cache on disk, passed to parse_file
+        self.parse_cache = parse_cache # ParseCache shared by all signatures, its keys include the signature hash
+        self.specialise = specialise # Parse with recognisers specialised to each signature
+        self.signatures = ParseCache(signatures) # Compiled parsers by signature hash, least recently used dropped first
+
+    # Runs fn in the worker pool, or straight away when there is none
+    async def run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # Serves one client until it disconnects
+    # Each request is started as soon as it is read and the responses are written in request order
+    async def serve_client(self, reader, writer):
+        pending = asyncio.Queue(WINDOW)
+
+        async def write_responses():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    return
+                writer.write((json.dumps(await task) + '\n').encode())
+                await writer.drain()
+
+        responder = asyncio.ensure_future(write_responses())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.ensure_future(self.respond(line)))
+            await pending.put(None)
+            await responder
+        except (ConnectionError, ValueError): # Client went away, or sent a line longer than MAX_LINE
+            responder.cancel()
+        finally:
+            writer.close()
+
+    # Carries out one request line and returns its response
+    # Any failure becomes a FAIL response for that request, so the responses after it are still sent
+    async def respond(self, line):
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects")
+            if request.get('op') == "load":
+                response = await self.load(request)
+            elif request.get('op') == "parse":
+                response = await self.parse(request)
+            else:
+                raise ValueError(f"Unknown op {request.get('op')!r}")
+        except ValueError as e:
+            response = {'status': "FAIL", 'message': str(e)}
+        except Exception as e: # Not a bad request, but it must not take the connection down either
+            response = {'status': "FAIL", 'message': f"{type(e).__name__}: {e}"}
+        if isinstance(request, dict) and 'id' in request: # Lines that are not objects have no id to copy
+            response = dict(id=request['id'], **response)
+        return response
+
+    # Loads a signature and adds it to the registry, along with checking the formula of the input if it has one
+    async def load(self, request):
+        if 'text' in request:
+            if not isinstance(request['text'], str):
+                raise ValueError("text must be a string")
+            path, data = None, request['text'].encode()
+        elif 'path' in request:
+            if not isinstance(request['path'], str):
+                raise ValueError("path must be a string")
+            path, data = request['path'], None
+        else:
+            raise ValueError("load needs a path or text")
+        status, message, parser = await self.run(_load_signature, path, data, self.cache_dir)
+        response = {'status': status, 'message': message}
+        if parser is None:
+            return response
+
+        formula = parser.symbols.pop('formula', None)
+        # A signature loaded before keeps its parser, along with the recogniser and worker copies made for it
+        known = self.signatures.get(parser.signature_hash)
+        if known is None:
+            self.signatures.put(parser.signature_hash, parser)
+        else:
+            parser = known
+        parser.parse_cache = self.parse_cache
+        parser.specialise = self.specialise
+        response['signature'] = parser.signature_hash
+        if formula is not None:
+            response['result'] = await self.check(parser, formula)
+        return response
+
+    # Validates a formula against a signature loaded before
+    async def parse(self, request):
+        signature = request.get('signature')
+        parser = self.signatures.get(signature) if isinstance(signature, str) else None
+        if parser is None:
+            raise ValueError("Unknown signature, load it first")
+        formula = request.get('formula')
+        if formula is None:
+            raise ValueError("parse needs a formula")
+        if not (isinstance(formula, str) or isinstance(formula, list) and all(isinstance(x, str) for x in formula)):
+            raise ValueError("formula must be a string or a list of tokens")
+        return await self.check(parser, formula)
+
+    async def check(self, parser, formula):
+        tokens = tokenize_formula(formula) if isinstance(formula, str) else formula
+        if self.executor is None or len(tokens) <= POOL_TOKENS:
+            outcome = check_formula(parser, tokens)
+        else:
+            outcome = await self.run(_parse_formula, parser.signature_hash, None, tokens)
+            if outcome is None: # The worker has not seen this signature yet, send it the parser
+                remote = copy.copy(parser)
+                remote.parse_cache = None # Workers do not share the cache, and it is not worth sending
+                outcome = await self.run(_parse_formula, parser.signature_hash, remote, tokens)
+        return dict(zip(['status', 'code', 'position'], outcome))
+
+# Worker side of the server, these must live at module level so they can be pickled
+_worker_parsers = ParseCache(MAX_SIGNATURES) # Parsers sent to this worker by signature hash
+
+def _init_worker(signatures):
+    global _worker_parsers
+    _worker_parsers = ParseCache(signatures)
+
+# Loads a signature, returns (status, console output, parser or None if the signature is invalid)
+def _load_signature(path, data, cache_dir):
+    console = io.StringIO()
+    with redirect_stdout(console):
+        parser = PredictiveParser(build_tree=False)
+        status = parse_file(path, parser, require_formula=False, cache_dir=cache_dir, data=data)
+    return status, console.getvalue(), parser if status == "OK" else None
+
+# Checks the tokens against a signature, returns None if the signature is unknown to this worker and no parser was given
+def _parse_formula(signature, parser, tokens):
+    if parser is not None:
+        _worker_parsers.put(signature, parser)
+    parser = _worker_parsers.get(signature)
+    if parser is None:
+        return None
+    return check_formula(parser, tokens)
+
+async def serve(args):
+    executor = None
+    if not args.jobs == 1:
+        from concurrent.futures import ProcessPoolExecutor # Only loaded when worker processes are used
+        executor = ProcessPoolExecutor(args.jobs or os.cpu_count(), initializer=_init_worker, initargs=(args.signatures,))
+    parse_cache = ParseCache(args.parse_cache) if args.parse_cache > 0 else None
+    server = ValidationServer(executor, cache_dir=args.cache_dir, parse_cache=parse_cache, specialise=args.specialise,
+                              signatures=args.signatures)
+    listener = await asyncio.start_server(server.serve_client, args.host, args.port, limit=MAX_LINE)
+    print(f"INFO:\tListening on {args.host}:{args.port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Serve formula validation over TCP with compiled signatures kept in memory.")
+    arg_parser.add_argument('--host', default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    arg_parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    arg_parser.add_argument('--jobs', type=int, default=0,
+                            help="Number of worker processes (0 for one per core, 1 does all the work in the server, default: 0)")
+    arg_parser.add_argument('--cache-dir', metavar='DIR', help="Cache compiled signatures in DIR as well as in memory")
+    arg_parser.add_argument('--parse-cache', metavar='N', type=int, default=4096,
+                            help="Remember the results of the last N distinct formulas (default: 4096, 0 is off)")
+    arg_parser.add_argument('--specialise', action='store_true',
+                            help="Check formulas with recognisers specialised to each signature")
+    arg_parser.add_argument('--signatures', metavar='N', type=int, default=MAX_SIGNATURES,
+                            help=f"Keep the last N signatures used in memory, older ones must be loaded again (default: {MAX_SIGNATURES})")
+    args = arg_parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
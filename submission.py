@@ -1,11 +1,19 @@
-from pprint import pprint
-from collections import defaultdict
-import matplotlib.pyplot as plt # For visualising graph
-import networkx as nx
-from networkx.drawing.nx_agraph import graphviz_layout
+from collections import defaultdict, deque, OrderedDict
+from contextlib import redirect_stdout
+from functools import partial
+from itertools import islice, compress, count
 import sys 
 import re
-import string
+import argparse
+import codecs
+import io
+import os
+import mmap
+import json
+import hashlib
+import time
+from array import array
+from types import MappingProxyType
 
 '''
 Production Rules:
@@ -26,416 +34,816 @@ Production Rules:
     form -> pred | ( var eq var ) | ( var eq const ) | ( const eq var ) | ( const eq const ) | ( form conn2 form ) | quan var form | conn1 form
 '''
 
-# Predictive Parser Class
-class PredictiveParser:
+# Compact parse tree stored as parallel arrays with one entry per node
+# Terminal nodes store their symbol table id, other nodes store -1
+class ParseTree:
+    LABELS = ('form', 'var', 'const', 'eq', 'conn1', 'conn2', 'quan', 'pred')
+    KINDS = {label: kind for kind, label in enumerate(LABELS)}
+    TERMINAL = len(LABELS)
+    root = 0 # Nodes are added in preorder so the root is always first
+
+    def __init__(self, tokens):
+        self.tokens = tokens # Symbol ids back to their tokens
+        self.kind = array('B')
+        self.token = array('i')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.last_child = array('i') # Only used to append children in O(1)
+        self.width = None # Number of tokens under each node, computed on demand by compute_widths
+        self.garbage = 0 # Nodes of subtrees replaced by graft that are no longer reachable
+
+    def __len__(self):
+        return len(self.kind) - self.garbage
+
+    # Appends a node under parent (None for the root) and returns its index
+    def add(self, kind, token, parent):
+        node = len(self.kind)
+        self.kind.append(kind)
+        self.token.append(token)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.last_child.append(-1)
+        if parent is None:
+            self.parent.append(-1)
+            return node
+        self.parent.append(parent)
+        if self.first_child[parent] == -1:
+            self.first_child[parent] = node
+        else:
+            self.next_sibling[self.last_child[parent]] = node
+        self.last_child[parent] = node
+        return node
+
+    # Called once parsing stops, nodes are complete as soon as they are added
+    def finish(self):
+        pass
+
+    # Yields the children of node from left to right
+    def children(self, node):
+        child = self.first_child[node]
+        while not child == -1:
+            yield child
+            child = self.next_sibling[child]
+
+    # The label of a node, either the production name or the terminal token
+    def label(self, node):
+        kind = self.kind[node]
+        if kind == self.TERMINAL:
+            return self.tokens[self.token[node]]
+        return self.LABELS[kind]
+
+    # Yields the nodes under node (the whole reachable tree by default) in preorder without recursing
+    def preorder(self, node=None):
+        stack = [self.root if node is None else node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(self.children(node))))
+
+    # Fills in the width column, children always come after their parent so one reverse pass is enough
+    def compute_widths(self):
+        width = array('i', (1 if kind == self.TERMINAL else 0 for kind in self.kind))
+        parent = self.parent
+        for node in range(len(width) - 1, 0, -1):
+            if not parent[node] == -1:
+                width[parent[node]] += width[node]
+        self.width = width
+
+    # Finds the smallest form node whose token span covers tokens start:end
+    # Returns the node and the position of its first token
+    def covering_form(self, start, end):
+        width = self.width
+        form = self.KINDS['form']
+        node = position = self.root
+        found = (node, position)
+        while True:
+            child_position = position
+            for child in self.children(node):
+                if child_position <= start and end <= child_position + width[child]:
+                    node, position = child, child_position
+                    if self.kind[node] == form:
+                        found = (node, position)
+                    break
+                child_position += width[child]
+            else:
+                return found
+
+    # Replaces the subtree at node with the whole of subtree, a freshly parsed ParseTree with widths
+    # The new nodes are appended and linked in place of the old ones, so nothing else is copied
+    def graft(self, node, subtree):
+        offset = len(self.kind)
+        shift = lambda column: (-1 if n == -1 else n + offset for n in column)
+        self.kind.extend(subtree.kind)
+        self.token.extend(subtree.token)
+        self.parent.extend(shift(subtree.parent))
+        self.first_child.extend(shift(subtree.first_child))
+        self.next_sibling.extend(shift(subtree.next_sibling))
+        self.last_child.extend(shift(subtree.last_child))
+        self.width.extend(subtree.width)
+        # Link the new root where the old one was among its siblings
+        new, parent = offset, self.parent[node]
+        self.parent[new] = parent
+        self.next_sibling[new] = self.next_sibling[node]
+        if self.first_child[parent] == node:
+            self.first_child[parent] = new
+        else:
+            previous = self.first_child[parent]
+            while not self.next_sibling[previous] == node:
+                previous = self.next_sibling[previous]
+            self.next_sibling[previous] = new
+        if self.last_child[parent] == node:
+            self.last_child[parent] = new
+        # Every ancestor now spans the difference in tokens
+        delta = subtree.width[0] - self.width[node]
+        while not parent == -1:
+            self.width[parent] += delta
+            parent = self.parent[parent]
+        self.garbage += sum(1 for _ in self.preorder(node))
+        if self.garbage > len(self):
+            self.compact()
+        return new
+
+    # Rebuilds the columns in preorder without the unreachable nodes left behind by graft
+    def compact(self):
+        order = list(self.preorder())
+        index = {node: i for i, node in enumerate(order)}
+        index[-1] = -1
+        self.kind = array('B', (self.kind[node] for node in order))
+        self.token = array('i', (self.token[node] for node in order))
+        for name in ('parent', 'first_child', 'next_sibling', 'last_child'):
+            column = getattr(self, name)
+            setattr(self, name, array('i', (index[column[node]] for node in order)))
+        if self.width is not None:
+            self.width = array('i', (self.width[node] for node in order))
+        self.garbage = 0
+
+    # Builds a networkx graph with the same "label[n" node ids the parser used to create
+    def to_networkx(self):
+        import networkx as nx # Only loaded when a graph is actually drawn
+        G = nx.DiGraph()
+        label_count = defaultdict(int) # Counts how many times a label appears in order to give unique ids
+        node_ids = {}
+        for node in self.preorder():
+            label = self.label(node)
+            label_count[label] += 1
+            node_id = f"{label}[{label_count[label]}"
+            node_ids[node] = node_id
+            G.add_node(node_id)
+            if not self.parent[node] == -1:
+                G.add_edge(node_ids[self.parent[node]], node_id)
+        return G
+
+# Hash-consed parse tree, structurally identical subtrees share a single node giving a DAG
+# Nodes are added in the same preorder as ParseTree and interned once all their children are known
+# Children are stored in compressed rows, the children of node are child_ids[child_start[node]:child_start[node+1]]
+class SharedTree:
+    LABELS = ParseTree.LABELS
+    TERMINAL = ParseTree.TERMINAL
+
+    def __init__(self, tokens):
+        self.tokens = tokens # Symbol ids back to their tokens
+        self.kind = array('B')
+        self.token = array('i')
+        self.child_start = array('i', [0])
+        self.child_ids = array('i')
+        self.refcount = array('i') # References to each node from other nodes (and the root)
+        self.root = -1
+        self.nodes = {} # (kind, token, children) -> node, only kept while building
+        self.open = [] # [handle, kind, token, children] for nodes whose subtrees are still being added
+        self.handles = 0 # Preorder handles given out by add, matching ParseTree indices
+
+    def __len__(self):
+        return len(self.kind)
+
+    # Opens a node under parent (None for the root) and returns its handle
+    # Nodes after parent in preorder are complete now, so they are interned first
+    def add(self, kind, token, parent):
+        if parent is not None:
+            while not self.open[-1][0] == parent:
+                self.close()
+        handle = self.handles
+        self.handles += 1
+        self.open.append((handle, kind, token, []))
+        return handle
+
+    # Interns the most recently opened node and adds it to its parent's children
+    def close(self):
+        _, kind, token, children = self.open.pop()
+        key = (kind, token, tuple(children))
+        node = self.nodes.get(key)
+        if node is None:
+            node = len(self.kind)
+            self.nodes[key] = node
+            self.kind.append(kind)
+            self.token.append(token)
+            self.child_ids.extend(children)
+            self.child_start.append(len(self.child_ids))
+            self.refcount.append(0)
+            for child in children:
+                self.refcount[child] += 1
+        if self.open:
+            self.open[-1][3].append(node)
+        else:
+            self.root = node
+            self.refcount[node] += 1
+        return node
+
+    # Called once parsing stops, interns the nodes that are still open
+    def finish(self):
+        while self.open:
+            self.close()
+        self.nodes = {}
+
+    # Yields the children of node from left to right
+    def children(self, node):
+        return iter(self.child_ids[self.child_start[node]:self.child_start[node+1]])
+
+    # The label of a node, either the production name or the terminal token
+    def label(self, node):
+        kind = self.kind[node]
+        if kind == self.TERMINAL:
+            return self.tokens[self.token[node]]
+        return self.LABELS[kind]
+
+    # Builds a networkx graph of the DAG, each shared node appears once
+    def to_networkx(self):
+        import networkx as nx # Only loaded when a graph is actually drawn
+        G = nx.DiGraph()
+        label_count = defaultdict(int) # Counts how many times a label appears in order to give unique ids
+        node_ids = []
+        for node in range(len(self)):
+            label = self.label(node)
+            label_count[label] += 1
+            node_ids.append(f"{label}[{label_count[label]}")
+            G.add_node(node_ids[node])
+            for child in self.children(node):
+                G.add_edge(node_ids[node], node_ids[child])
+        return G
+
+# Nonterminal grammar symbol, terminals are plain token strings
+class NonTerminal:
+    __slots__ = ('name', 'kind', 'error')
+
+    def __init__(self, name, kind=None, error="UNEX_SYMBOL"):
+        self.name = name
+        self.kind = kind # ParseTree node kind, None if it does not appear in the tree
+        self.error = error # Syntax error code thrown if it cannot be expanded
+
+    def __repr__(self):
+        return self.name
+
+FORM = NonTerminal('form', ParseTree.KINDS['form'])
+VAR = NonTerminal('var', ParseTree.KINDS['var'], "EX_VAR")
+CONST = NonTerminal('const', ParseTree.KINDS['const'], "EX_VC")
+EQ = NonTerminal('eq', ParseTree.KINDS['eq'], "EX_EQ")
+CONN1 = NonTerminal('conn1', ParseTree.KINDS['conn1'])
+CONN2 = NonTerminal('conn2', ParseTree.KINDS['conn2'], "EX_CONN2")
+QUAN = NonTerminal('quan', ParseTree.KINDS['quan'])
+PRED = NonTerminal('pred', ParseTree.KINDS['pred'])
+
+END = None # Lookahead once the token stream is exhausted
+
+# Add to first [] to add additional 'inner word' characters, second is special single characters
+FORMULA_TOKEN = re.compile(r"[\w\\=]+|[,()]")
+TOKEN_TAIL = re.compile(r"[\w\\=]+\Z") # A token at the end of a chunk that may carry on into the next
+FIRST_WORD = re.compile(rb"\s*\S*") # The field name word starting a line
+FORBIDDEN_SUBSTRING = re.compile(r"[,():]") # Characters no symbol may contain
+PREDICATE_NAME = re.compile(r"[A-Za-z0-9_]*") # Allowed predicate names
+# Allowed first character of the symbols in each field, None is for the other fields
+FIRST_CHARACTER = {
+    "connectives": re.compile(r"[A-Za-z0-9\\_]"),
+    "quantifiers": re.compile(r"[A-Za-z0-9\\_]"),
+    "equality": re.compile(r"[A-Za-z0-9\\=_]"),
+    None: re.compile(r"[A-Za-z0-9_]"),
+}
+CHUNK_SIZE = 1 << 16 # Bytes (or characters) of the formula lexed at a time
+PARALLEL_CHUNK_SIZE = 1024 # Formulas sent to a worker process at a time
+FILE_CHUNK_SIZE = 16 # Input files sent to a worker process at a time
+ERROR_CONTEXT = 20 # Tokens shown either side of a syntax error, the rest of a longer formula is cut to ...
+
+CACHE_VERSION = "3" # Bump when the compiled signature format changes to invalidate cached entries
+CACHED_FIELDS = {'variables', 'constants', 'predicates', 'equality', 'connectives', 'quantifiers',
+                 'connectives1', 'connectives2'} # Symbols a signature cache entry must hold
+TERMINAL_ERRORS = {'(': "EX_BRACKET", ')': "EX_BRACKET", ',': "EX_COMMA"} # Error codes for unmatched terminals
+SYNC_TOKENS = {')', ','} # Tokens error recovery resynchronises on, along with any connective
+SYNC_CATEGORIES = {'connectives1', 'connectives2'}
+CONNECTIVE_MEANINGS = ['and', 'or', 'implies', 'iff'] # Meaning of connectives2 by position, negation is the last connective
+QUANTIFIER_MEANINGS = ['exists', 'forall'] # Meaning of the quantifiers by position
+
+# Bounded LRU cache of parse results so a repeated formula costs one dictionary lookup
+# Keys are (signature hash, tree builder, error recovery, tokens)
+# Entries are (code, syntax code, index, lookahead, tree, error list)
+# Trees are only kept for valid formulas, and only when the parser builds them
+class ParseCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize # Least recently used entries are dropped beyond this many
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns the entry for key, marking it as most recently used, or None
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+# Profiling hooks, records the wall time of each phase and counts what the parser does
+# Only used when a Profile is given to the parser, otherwise nothing is recorded
+class Profile:
     def __init__(self):
+        self.timings = defaultdict(float) # Seconds spent in each phase
+        self.expansions = defaultdict(int) # Lookups in the LL(1) table for each nonterminal
+        self.counters = defaultdict(int) # Other events, such as matched terminals
+        self.last = time.perf_counter()
+
+    # Adds the time since the previous lap to phase, with no phase the clock is only restarted
+    def lap(self, phase=None):
+        now = time.perf_counter()
+        if phase is not None:
+            self.timings[phase] += now - self.last
+        self.last = now
+
+    # Parses with parser while counting the expansions of every nonterminal and the matched terminals
+    # The counting rows are only given to this parser, the grammar it may share with others is left alone
+    def parse(self, parser, string):
+        parser.counting_rows = {
+            symbol: CountingRow(row, self.expansions, repr(symbol)) for symbol, row in parser.grammar.parse_table.items()
+        }
+        parser.profile = None
+        parser.matched = 0
+        cache = parser.parse_cache
+        hits = 0 if cache is None else cache.hits
+        lexing = self.timings["tokenize"]
+        self.lap()
+        try:
+            code = parser.parse(string)
+        finally:
+            parser.counting_rows = None
+            parser.profile = self
+        self.lap("parse")
+        self.timings["parse"] -= self.timings["tokenize"] - lexing # Time in a timed FormulaLexer is tokenizing
+        self.counters["parse"] += 1
+        if cache is not None and cache.hits > hits:
+            self.counters["cache_hit"] += 1 # Answered from the cache, nothing was matched
+        self.counters["match"] += parser.matched # Terminals matched, tokens skipped by error recovery are not
+        return code
+
+    def write(self, path):
+        f = open(path, mode='w')
+        json.dump({'timings': self.timings, 'expansions': self.expansions, 'counters': self.counters}, f, indent=4)
+        f.close()
+
+# Row of the LL(1) table counting the lookups made in it, only used while profiling
+class CountingRow(dict):
+    def __init__(self, row, counts, name):
+        super().__init__(row)
+        self.counts = counts
+        self.name = name
+
+    def get(self, lookahead, default=None):
+        self.counts[self.name] += 1
+        return dict.get(self, lookahead, default)
+
+# Signature compiled into its grammar and LL(1) table by compile_symbols, never changed afterwards
+# A Grammar holds no state of any parse, so one can be shared by many parsers, threads and asyncio tasks
+# without copying, while each parse keeps its own state in a ParseContext
+# Its contents are copied into read-only mappings and tuples when it is built, so nothing reachable from it
+# can be changed either
+class Grammar:
+    __slots__ = ('symbols', 'table', 'tokens', 'productions', 'parse_table', 'start', 'signature_hash', 'closers',
+                 'specialised', '_table', '_parse_table')
+
+    def __init__(self, symbols=None, table=None, tokens=None, productions=None, parse_table=None, start=FORM,
+                 signature_hash=None):
+        table = dict(table or {})
+        parse_table = {nt: {t: tuple(a) for t, a in row.items()} for nt, row in (parse_table or {}).items()}
+        fields = {
+            # Symbols of each field of the signature
+            'symbols': MappingProxyType({k: tuple(v) for k, v in (symbols or {}).items()}),
+            # Compiled symbol table mapping token -> (category, arity, id)
+            'table': MappingProxyType(table),
+            'tokens': tuple(tokens or ()), # Interned symbol ids back to their tokens
+            # Grammar productions generated from the signature
+            'productions': MappingProxyType({nt: tuple(map(tuple, a)) for nt, a in (productions or {}).items()}),
+            # LL(1) table mapping nonterminal -> lookahead -> alternative
+            'parse_table': MappingProxyType({nt: MappingProxyType(row) for nt, row in parse_table.items()}),
+            'start': start, # Start symbol, kept with the table so pickled copies stay consistent
+            'signature_hash': signature_hash, # Hash of the signature lines
+            'closers': MappingProxyType(closing_brackets(parse_table)), # Used by error recovery, see closing_brackets
+            'specialised': None, # Specialised recogniser, built on first use
+            # The dicts behind table and parse_table, only read by ParseContext as plain dict lookups are faster
+            '_table': table,
+            '_parse_table': parse_table,
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Grammar is immutable, compile a new one instead")
+
+    # Pickled by its contents as plain dicts, read-only mappings cannot be pickled
+    # The specialised recogniser is a closure so it is built again on first use
+    def __reduce__(self):
+        parse_table = {nt: dict(row) for nt, row in self.parse_table.items()}
+        return (Grammar, (dict(self.symbols), dict(self.table), self.tokens, dict(self.productions), parse_table,
+                          self.start, self.signature_hash))
+
+    # Returns the recogniser specialised to this signature, see specialised_recogniser
+    # Threads racing to build it get identical recognisers, so at worst the work is done twice
+    def recogniser(self):
+        if self.specialised is None:
+            object.__setattr__(self, 'specialised', specialised_recogniser(self))
+        return self.specialised
+
+# Function to find the nonterminals every expansion of which ends with a closing bracket
+# Maps each nonterminal of the parse table to ')' if so, otherwise to None
+def closing_brackets(parse_table):
+    closers = {}
+
+    def closing_bracket(symbol):
+        if not symbol in closers:
+            closers[symbol] = None # Also stops the search looping on recursive alternatives
+            ends = set()
+            for alternative in parse_table[symbol].values():
+                last = alternative[0] # Alternatives are stored reversed
+                ends.add(closing_bracket(last) if type(last) is NonTerminal else last)
+            closers[symbol] = ')' if ends == {')'} else None
+        return closers[symbol]
+
+    for symbol in parse_table:
+        closing_bracket(symbol)
+    return closers
+
+EMPTY_GRAMMAR = Grammar() # Grammar of a parser before a signature is loaded
+
+# State of a single parse against a Grammar, cheap enough to create one for every parse
+# parse_table replaces the grammar's table, the profiler uses it to count lookups
+class ParseContext:
+    __slots__ = ('grammar', 'parse_table', 'build_tree', 'share_subtrees', 'recover', 'specialise', 'lookahead', 'string',
+                 'index', 'syntax_code', 'error_list', 'tree', 'matched', 'skipped')
+
+    def __init__(self, grammar, build_tree=True, share_subtrees=False, recover=False, specialise=False,
+                 parse_table=None):
+        self.grammar = grammar
+        self.parse_table = grammar._parse_table if parse_table is None else parse_table
+        self.build_tree = build_tree # If False only recognise the formula, no tree is built
+        self.share_subtrees = share_subtrees # If True the tree is a SharedTree DAG instead of a ParseTree
+        self.recover = recover # If True recover from syntax errors and keep parsing to find them all
+        self.specialise = specialise # If True recognise-only parses use the grammar's specialised recogniser
         self.lookahead = None
         self.string = None
         self.index = 0
         self.syntax_code = "OK" # Default syntax code is "OK"!
-        self.error_list = []
-        self.symbols = defaultdict(list) # Dictionary containing information on symbols
-        self.symbol_count = defaultdict(int) # Counts how many times a symbol appears in order to give unique label in graph
-        self.G = nx.DiGraph() # Parse tree for displaying later
+        self.error_list = [] # (code, index, lookahead, location) of every syntax error found
+        self.tree = None # Parse tree, built while parsing unless in recognise-only mode
+        self.matched = 0 # Terminals matched, which leaves out tokens skipped by error recovery
+        self.skipped = 0
 
-    # Simply updates the syntax error code
-    def throw_syntax_error(self, code):
+    # Records a syntax error, the syntax code stays the code of the first one
+    # location is the (line, column) of the error in the input file when the tokens come from a FormulaLexer
+    def throw_syntax_error(self, code, index=0, lookahead=END, location=None):
         if self.syntax_code == "OK":
             self.syntax_code = code
+        self.error_list.append((code, index, lookahead, location))
+
+    # Table-driven LL(1) parse of the tokens using an explicit stack
+    # so arbitrarily deep formulas never recurse in Python
+    # string can be any iterable of tokens, they are consumed lazily and never modified
+    def parse(self, string):
+        # Formulas that only need a verdict are first run through the specialised recogniser
+        # if it rejects them the generic parser below finds the error code and position
+        if self.specialise and not self.build_tree and not self.recover and type(string) in (list, tuple, FormulaLexer):
+            length = self.grammar.recogniser()(string)
+            if length:
+                self.syntax_code = "OK"
+                self.error_list = []
+                self.string = string
+                self.index = self.matched = length
+                self.lookahead = END
+                self.tree = None
+                return 0
+        self.syntax_code = "OK"
+        self.error_list = []
+        self.string = string 
+        self.index = 0
+        tokens = iter(string)
+        locate = string.location if type(string) is FormulaLexer else lambda: None
+        lookahead = next(tokens, END) # Set the initial lookahead
+        self.lookahead = lookahead
+        if lookahead is END:
+            self.throw_syntax_error("EMPTY")
+            return 1
+        self.tree = tree = None
+        if self.build_tree:
+            self.tree = tree = (SharedTree if self.share_subtrees else ParseTree)(self.grammar.tokens)
+        table = self.grammar._table
+        parse_table = self.parse_table
+
+        index = 0
+        stack = [(self.grammar.start, None)] # Pairs of (grammar symbol, parent node in the tree)
+        code = 0
+        while stack:
+            symbol, parent = stack.pop()
+            if type(symbol) is NonTerminal:
+                # Pick the alternative predicted by the lookahead
+                alternative = parse_table[symbol].get(lookahead)
+                if alternative is not None:
+                    if tree is not None and symbol.kind is not None:
+                        parent = tree.add(symbol.kind, -1, parent)
+                    stack.extend((child, parent) for child in alternative)
+                    continue
+                error = symbol.error if lookahead in table else "UNKNOWN_SYMBOL"
+            elif symbol == lookahead:
+                # Match the terminal and move on to the next lookahead
+                if tree is not None:
+                    tree.add(ParseTree.TERMINAL, table[lookahead][2], parent)
+                index += 1
+                lookahead = next(tokens, END)
+                continue
+            else:
+                error = TERMINAL_ERRORS.get(symbol, "UNEX_SYMBOL")
+            # Syntax Error
+            self.throw_syntax_error(error, index, lookahead, locate())
+            code = 1
+            if not self.recover:
+                break
+            # The symbol may still match once the input is resynchronised, for left factored tails
+            # inside brackets only the closing bracket is kept so that it can still be matched
+            stack.append((self.grammar.closers.get(symbol) or symbol, parent))
+            index, lookahead = self.synchronise(stack, tokens, index, lookahead)
+
+        if (self.recover or not code) and not lookahead is END:
+            code = 1
+            self.throw_syntax_error("EX_END", index, lookahead, locate())
+        if tree is not None:
+            tree.finish()
+        self.matched = index - self.skipped
+        if code:
+            _, index, lookahead, _ = self.error_list[0] # Report the position of the first error
+        self.index = index
+        self.lookahead = lookahead
+        return code
+
+    # Panic mode error recovery, skips tokens up to the next ')', ',' or connective outside any skipped
+    # brackets that a symbol on the stack can continue from, and pops the stack down to that symbol
+    # Returns the new (index, lookahead), the stack is emptied if the end of input is reached
+    def synchronise(self, stack, tokens, index, lookahead):
+        table = self.grammar._table
+        parse_table = self.parse_table
+        depth = 0 # Brackets opened by skipped tokens
+        while not lookahead is END:
+            if depth == 0 and (lookahead in SYNC_TOKENS or table.get(lookahead, ('',))[0] in SYNC_CATEGORIES):
+                for top in range(len(stack) - 1, -1, -1):
+                    symbol = stack[top][0]
+                    if type(symbol) is NonTerminal and lookahead in parse_table[symbol] or symbol == lookahead:
+                        del stack[top + 1:]
+                        return index, lookahead
+            if lookahead == '(':
+                depth += 1
+            elif lookahead == ')' and depth > 0:
+                depth -= 1
+            index += 1
+            self.skipped += 1
+            lookahead = next(tokens, END)
+        stack.clear()
+        return index, lookahead
+
+# Predictive Parser Class
+# Holds the options, the Grammar of the loaded signature and the results of the last parse
+# A parser is used by one thread at a time, concurrent parses share the Grammar and each use their own
+# parser (see the grammar argument) or ParseContext
+class PredictiveParser:
+    def __init__(self, build_tree=True, share_subtrees=False, parse_cache=None, recover=False, profile=None,
+                 specialise=False, grammar=None):
+        self.lookahead = None
+        self.string = None
+        self.index = 0
+        self.syntax_code = "OK" # Default syntax code is "OK"!
+        self.error_list = [] # (code, index, lookahead, location) of every syntax error found by the last parse
+        self.grammar = EMPTY_GRAMMAR if grammar is None else grammar # Compiled signature, set by parse_file
+        self.symbols = defaultdict(list, self.grammar.symbols) # Dictionary containing information on symbols
+        self.build_tree = build_tree # If False only recognise the formula, no tree is built
+        self.share_subtrees = share_subtrees # If True the tree is a SharedTree DAG instead of a ParseTree
+        self.tree = None # Parse tree, built while parsing unless in recognise-only mode
+        self.formula_source = None # (data, start, end, line, column) of the formula in the input file when streaming
+        self.signature_hash = self.grammar.signature_hash # Hash of the signature lines, set by parse_file
+        self.parse_cache = parse_cache # Optional ParseCache consulted before parsing, may be shared between parsers
+        self.recover = recover # If True recover from syntax errors and keep parsing to find them all
+        self.profile = profile # Optional Profile recording timings and counters
+        self.specialise = specialise # If True recognise-only parses use a recogniser specialised to the signature
+        self.counting_rows = None # Parse table used instead of the grammar's while profiling
+        self.matched = 0 # Terminals matched by the last parse that ran, see ParseContext
+
+    # The compiled signature is read from the grammar
+    @property
+    def table(self):
+        return self.grammar.table
+
+    @property
+    def tokens(self):
+        return self.grammar.tokens
+
+    @property
+    def productions(self):
+        return self.grammar.productions
+
+    @property
+    def parse_table(self):
+        return self.grammar.parse_table
+
+    @property
+    def start(self):
+        return self.grammar.start
 
     # Prints the parse tree using networkx and matplotlib
+    # The visualisation libraries are slow to import so they are only loaded here
     def print_graph(self):
-        pos=graphviz_layout(self.G, prog='dot') # defined position of nodes in G
+        import matplotlib.pyplot as plt # For visualising graph
+        import networkx as nx
+        from networkx.drawing.nx_agraph import graphviz_layout
+        G = self.tree.to_networkx()
+        pos=graphviz_layout(G, prog='dot') # defined position of nodes in G
         # Draw the graph with transparent nodes and reduced font size
         plt.figure(1, figsize=(12,12))
-        plt.title(' '.join(self.symbols['formula'])) # Display the input formula
-        nodes = self.G.nodes()
+        plt.title(' '.join(formula_tokens(self))) # Display the input formula
+        nodes = G.nodes()
         labels = {node: node[:node.find('[')] for node in nodes}
-        nx.draw(self.G, pos, labels=labels, arrows=False, node_color=[[1.0,1.0,1.0,1.0]], node_shape='s', font_size=8)
+        nx.draw(G, pos, labels=labels, arrows=False, node_color=[[1.0,1.0,1.0,1.0]], node_shape='s', font_size=8)
         plt.savefig("tree.png")
         # plt.show(block=1)
 
-    # start function to begin parsing token stream from
+    # Parses the tokens, answering from the parse cache when the formula has been seen before
+    # With a cache the tokens are read into a tuple to form the key, so they are no longer streamed
     def parse(self, string):
-        if len(string) == 0:
-            self.throw_syntax_error("EMPTY")
-            return 1
-        self.string = string 
-        self.index = 0 
-        self.lookahead = string[0] # Set the initial lookahead
-        code = self.formula(None)
-        if not self.index == len(self.string) - 1:
-            code = 1
-            self.throw_syntax_error("EX_END")
+        if self.profile is not None:
+            return self.profile.parse(self, string)
+        cache = self.parse_cache
+        if cache is None:
+            return self.parse_uncached(string)
+        string = tuple(string)
+        builder = (SharedTree if self.share_subtrees else ParseTree) if self.build_tree else None
+        key = (self.signature_hash, builder, self.recover, string)
+        entry = cache.get(key)
+        if entry is None:
+            code = self.parse_uncached(string)
+            cache.put(key, (code, self.syntax_code, self.index, self.lookahead, None if code else self.tree, self.error_list))
+            return code
+        code, self.syntax_code, self.index, self.lookahead, self.tree, self.error_list = entry
+        self.string = string
         return code
 
-    # Match c with the current lookahead
-    def match(self, c):
-        if self.lookahead == c:
-            self.index += 1
-            if self.index < len(self.string): # Get next lookahead if available
-                self.lookahead = self.string[self.index]
-            else:
-                self.lookahead = "" 
-                self.string.append("")
-            return 0
-        return 1 
-
-    # function to resolve form production rule.
-    # also the start symbol
-    # form -> many
-    def formula(self, parent):
-        # Create formula node in graph
-        self.symbol_count['form']+=1
-        node_id = f"form[{self.symbol_count['form']}"
-        self.G.add_node(node_id)
-        if parent: # If it has a parent add an edge to it
-            self.G.add_edge(parent, node_id)
-        parent = node_id
-        
-        # Check if lookahead is a recognised symbol
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            code = 1
-        # Check if lookahead is a predicate
-        elif self.lookahead in [x[0] for x in self.symbols['predicates']]:
-            # form -> pred
-            code = self.predicates(parent)
-        # Check if lookahead is a quantifier
-        elif self.lookahead in self.symbols['quantifiers']:
-            # form -> quan var form
-            code = self.quantifier(parent)
-            code = code if code else self.variable(parent)
-            if code: self.throw_syntax_error("EX_VAR")
-            code = code if code else self.formula(parent)
-        # Check if lookahead is in connectives with arity 1
-        elif self.lookahead in self.symbols['connectives1']:
-            # form -> conn1 form
-            code = self.connective1(parent)
-            code = code if code else self.formula(parent)
-        # Check if lookahead opens a bracketed statement
-        elif self.lookahead == '(':
-            # try all possibilities
-            # not expensive to do as only formula recurses
-            code = self.match('(')
-            
-            # Add a bracket node to the graph
-            self.symbol_count['(']+=1
-            node_id = f"([{self.symbol_count['(']}"
-            self.G.add_node(node_id)
-            self.G.add_edge(parent, node_id)
-            
-            # Check if lookahead is either variable, constant (continue) or formula (kill early)
-            if not self.variable(parent):
-                pass
-            elif not self.constant(parent):
-                pass
-            # form -> ( form conn2 form )
-            elif not self.formula(parent):
-                code = code if code else self.connective2(parent)
-                if code: self.throw_syntax_error("EX_CONN2")
-                code = code if code else self.formula(parent)
-                code = code if code else self.match(')')
-                if code: self.throw_syntax_error("EX_BRACKET")
-                self.symbol_count[')'] += 1
-                node_id = f")[{self.symbol_count[')']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                return code
-            else:
-                # Syntax Error
-                code = 1
-                self.throw_syntax_error("UNEX_SYMBOL")
-
-            code = code if code else self.equality(parent)
-            if code: self.throw_syntax_error("EX_EQ")
-
-            # Check if either variable or constant 
-            # form -> ( var|const eq var )
-            if not self.variable(parent):
-                pass
-            # form -> ( var|cnst eq const )
-            elif not self.constant(parent):
-                pass
-            else:
-                # Syntax Error
-                self.throw_syntax_error("EX_VC")
-                code = 1
-
-            code = code if code else self.match(')')
-            if code: self.throw_syntax_error("EX_BRACKET")
-
-            # Add closing bracket node
-            self.symbol_count[')']+=1
-            node_id = f")[{self.symbol_count[')']}"
-            self.G.add_node(node_id)
-            self.G.add_edge(parent, node_id)
+    # Incremental parse after the tokens start:end of the previous formula are replaced by new_tokens
+    # Only the smallest form subtree covering the edit is reparsed and grafted into the previous tree
+    # If that fails, or there is no valid previous tree to reuse, the whole formula is parsed again
+    # Trees held by a parse cache are shared, so with a cache every edit is a full parse
+    def reparse(self, start, end, new_tokens):
+        if not isinstance(self.string, (list, tuple)):
+            raise ValueError("reparse needs the previous formula to have been parsed from a list of tokens")
+        tokens = list(self.string) # A copy, the previous formula may be a list the caller still holds
+        tree = self.tree
+        reusable = (type(tree) is ParseTree and self.syntax_code == "OK" and self.parse_cache is None
+                    and 0 <= start <= end <= len(tokens))
+        tokens[start:end] = new_tokens
+        if not reusable:
+            return self.parse(tokens)
+        if tree.width is None:
+            tree.compute_widths()
+        node, position = tree.covering_form(start, end)
+        if node == tree.root:
+            return self.parse(tokens)
+        length = tree.width[node] + len(tokens) - tree.width[tree.root]
+        if self.parse_uncached(tokens[position:position + length]):
+            return self.parse(tokens)
+        self.tree.compute_widths()
+        tree.graft(node, self.tree)
+        self.tree = tree
+        self.string = tokens
+        self.index = len(tokens)
+        return 0
 
-        else:
-            # Syntax Error
-            self.throw_syntax_error("UNEX_SYMBOL")
-            code = 1
+    # Parses the tokens in a new ParseContext and keeps its results
+    def parse_uncached(self, string):
+        context = ParseContext(self.grammar, self.build_tree, self.share_subtrees, self.recover, self.specialise,
+                               self.counting_rows)
+        code = context.parse(string)
+        self.lookahead, self.string, self.index = context.lookahead, context.string, context.index
+        self.syntax_code, self.error_list, self.tree = context.syntax_code, context.error_list, context.tree
+        self.matched = context.matched
         return code
 
-    # var -> x_1 | ... | x_n
-    def variable(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        variables = self.symbols['variables']
-        for v in variables:
-            if self.lookahead == v:
-                # If the lookahead matches a variable create variable node
-                self.symbol_count['var']+=1
-                node_id = f"var[{self.symbol_count['var']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create terminal node
-                self.symbol_count[v]+=1
-                node_id = f"{v}[{self.symbol_count[v]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(v)
-                return 0
-        
-        # syntax error
-        return 1
-
-    # const -> C_1 | ... | C_n
-    def constant(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        constants = self.symbols['constants']
-        for c in constants:
-            if self.lookahead == c:
-                # If the lookahead matches a constant create const node
-                self.symbol_count['const']+=1
-                node_id = f"const[{self.symbol_count['const']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create terminal node
-                self.symbol_count[c]+=1
-                node_id = f"{c}[{self.symbol_count[c]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(c)
-                return 0
-
-        # syntax error
-        return 1
-    
-    # eq (EG) -> =
-    def equality(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        equality = self.symbols['equality']
-        for e in equality:
-            if self.lookahead == e:
-                # If the lookahead matches an equality node create a eq node
-                self.symbol_count['eq']+=1
-                node_id = f"eq[{self.symbol_count['eq']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create terminal node
-                self.symbol_count[e]+=1
-                node_id = f"{e}[{self.symbol_count[e]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(e)
-                return 0
-        # syntax error
-        return 1
-
-    # form (EG) -> OR | AND | ... 
-    def connective2(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        connectives2 = self.symbols['connectives2']
-        for c in connectives2:
-            if self.lookahead == c:
-                # If the lookahead matches a connective2 create conn2 node
-                self.symbol_count['conn2']+=1
-                node_id = f"conn2[{self.symbol_count['conn2']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create a terminal node
-                self.symbol_count[c]+=1
-                node_id = f"{c}[{self.symbol_count[c]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(c)
-                return 0
-        # syntax error
-        return 1
-    
-    # conn1 (EG) -> NEG
-    def connective1(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        connectives1 = self.symbols['connectives1']
-        for c in connectives1:
-            if self.lookahead == c:
-                # If the lookahead matches a connective1 create a conn1 node
-                self.symbol_count['conn1']+=1
-                node_id = f"conn1[{self.symbol_count['conn1']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create terminal node
-                self.symbol_count[c]+=1
-                node_id = f"{c}[{self.symbol_count[c]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(c)
-                return 0
-        # syntax
-        return 1
-
-    # quan (EG) -> EXISTS | FORALL
-    def quantifier(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        quantifiers = self.symbols['quantifiers']
-        for q in quantifiers:
-            if self.lookahead == q:
-                # If the lookahead matches a quantifier create a quan node
-                self.symbol_count['quan']+=1
-                node_id = f"quan[{self.symbol_count['quan']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Create a terminal node
-                self.symbol_count[q]+=1
-                node_id = f"{q}[{self.symbol_count[q]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                self.match(q)
-                return 0
-        # syntax
-        return 1
-
-    # pred -> P ( var, ..., var ) | ...
-    def predicates(self, parent):
-        # Check if the lookahead symbol is known
-        if not self.lookahead in self.symbols['all']:
-            self.throw_syntax_error("UNKNOWN_SYMBOL")
-            return 1
-        predicates = self.symbols['predicates']
-        for p in predicates:
-            if self.lookahead == p[0]:
-                # If the lookahead matches a predicate identifier create a pred node
-                self.symbol_count['pred']+=1
-                node_id = f"pred[{self.symbol_count['pred']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-                parent = node_id
-
-                # Add the pred identifier as a terminal node
-                code = self.match(p[0])
-                self.symbol_count[p[0]]+=1
-                node_id = f"{p[0]}[{self.symbol_count[p[0]]}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-
-                # If the next lookahead matches (, create a new node
-                code = code if code else self.match('(')
-                if code: self.throw_syntax_error("EX_BRACKET")
-                self.symbol_count['(']+=1
-                node_id = f"([{self.symbol_count['(']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-
-                # Check if the arity of the predicate is correct and contains only variables
-                # Create new nodes as we go
-                for i in range(p[1]-1):
-                    code = code if code else self.variable(parent)
-                    if code: self.throw_syntax_error("EX_VAR")
-                    code = code if code else self.match(',')
-                    if code: self.throw_syntax_error("EX_COMMA")
-                    self.symbol_count[',']+=1
-                    node_id = f",[{self.symbol_count[',']}"
-                    self.G.add_node(node_id)
-                    self.G.add_edge(parent, node_id)
-                # Final variable
-                code = code if code else self.variable(parent)
-                if code: self.throw_syntax_error("EX_VAR")
-                code = code if code else self.match(')')
-                if code: self.throw_syntax_error("EX_BRACKET")
-                self.symbol_count[')']+=1
-                node_id = f")[{self.symbol_count[')']}"
-                self.G.add_node(node_id)
-                self.G.add_edge(parent, node_id)
-
-                return code
-        # syntax error
-        return 1
-
 # function to parse file and check if its contents are valid
-def parse_file(path, parser):
+# if require_formula is False only the signature fields are required, as in batch mode
+# if stream is True the formula tokens are not read into memory, see formula_tokens
+# if cache_dir is set compiled signatures are cached there, keyed by a hash of the signature lines
+# if data is given it is used as the contents of the file (bytes) and path is not opened
+def parse_file(path, parser, require_formula=True, stream=False, cache_dir=None, data=None):
     # ensure file contains all required fields
     REQUIRED_FIELDS = set(["variables", "constants", "predicates", "equality", "connectives", "quantifiers", "formula"])
+    OPTIONAL_FIELDS = set() if require_formula else set(["formula"])
+    REQUIRED_FIELDS = REQUIRED_FIELDS - OPTIONAL_FIELDS
     seen_fields = []
 
+    profile = parser.profile
+    if profile is not None:
+        profile.lap()
+
+    # Start from no symbols, so a parser can load another signature
+    parser.symbols = defaultdict(list)
     # populate the symbols with some symbols that are always present
-    parser.symbols['all'] = [',', '(', ')']
-    FORBIDDEN_SUBSTRINGS = [',', '(', ')', ':']
+    # Every symbol seen so far, a set so each conflict check is one lookup however large the signature
+    reserved = parser.symbols['all'] = set([',', '(', ')'])
 
-    # Try to open the file
-    try:
-        f = open(path, mode='r')
-    except Exception as e:
-        print("ERROR: Failed to open file!")
-        return "FAIL"
-    file_lines = f.readlines()
-    f.close()
+    if data is None:
+        # Try to open the file
+        try:
+            f = open(path, mode='rb')
+        except Exception as e:
+            print("ERROR: Failed to open file!")
+            return "FAIL"
+        # Memory map the file so the formula is never copied while scanning the lines
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty files cannot be mapped
+            data = b''
+        f.close()
 
+    # Scan the lines, locating the formula and collecting the signature lines
     current_field = None
-    for l in file_lines: # Iterate through the lines in the file
+    formula_span = None # [start, end) byte offsets of the formula field, then its line and column
+    signature_lines = [] # (field, is header, raw line) for every line outside the formula
+    pos = 0
+    line = 0
+    while pos < len(data): # Iterate through the lines in the file
+        line += 1
+        end = data.find(b'\n', pos)
+        end = len(data) if end == -1 else end + 1
+        colon = data.rfind(b':', pos, end)
+        # The formula is only located here, its tokens are read later straight from the file
+        if colon == -1 and current_field == "formula":
+            formula_span[1] = end
+            pos = end
+            continue
+
         # Get field name if possible
-        z = re.match(r"(.*):", l)
-        if z:
-            current_field = z.groups()[0]
+        if not colon == -1:
+            current_field = data[pos:colon].decode()
             if current_field in seen_fields:
                 print("ERROR: Duplicate field encountered!")
                 return "FAIL"
-            values = l.split()[1:]
             seen_fields.append(current_field)
+            if current_field == "formula":
+                start = FIRST_WORD.match(data, pos, end).end()
+                formula_span = [start, end, line, len(data[pos:start].decode(errors='replace'))]
+                pos = end
+                continue
+        signature_lines.append((current_field, not colon == -1, data[pos:end]))
+        pos = end
+
+    if not set(seen_fields) - OPTIONAL_FIELDS == REQUIRED_FIELDS:
+        print("ERROR: Input file was missing fields!")
+        return "FAIL"
+
+    if profile is not None:
+        profile.lap("read")
+
+    # Keep the formula in the file when streaming, otherwise read its tokens now
+    parser.formula_source = None
+    if formula_span:
+        if stream:
+            parser.formula_source = (data, *formula_span)
         else:
-            values = l.split() # continuing from a previous line 
+            parser.symbols['formula'] = list(FormulaLexer(data, *formula_span))
+            if profile is not None:
+                profile.lap("tokenize")
 
-        # If the current field is a formula, deal with the special case
-        if current_field == "formula":
-            split_values = []
-            for v in values:
-                # Add to first [] to add additional 'inner word' characters
-                # Second is special single characters
-                # Third is groups of special characters
-                split = [x for x in re.findall(r"[\w\\=]+|[,()]", v) if not x == ''] 
-                split_values = split_values + split # rebuild values
-            values = split_values
-
-        if not current_field in ["formula", "predicates"] and True in [x in parser.symbols['all'] for x in values]:
+    # A signature that was compiled before is loaded from the cache without validating it again
+    parser.signature_hash = signature_hash(line for _, _, line in signature_lines)
+    cache_path = os.path.join(cache_dir, parser.signature_hash + ".json") if cache_dir else None
+    if cache_path and load_compiled(parser, cache_path):
+        if profile is not None:
+            profile.lap("cache")
+        return "OK"
+
+    for current_field, header, line in signature_lines:
+        values = line.decode().split()
+        if header: # drop the field name, other lines continue the previous field
+            values = values[1:]
+
+        if not current_field == "predicates" and not reserved.isdisjoint(values):
             print("ERROR: Reserved keyword or conflicting token detected in input file!")
             return "FAIL"
 
@@ -444,56 +852,41 @@ def parse_file(path, parser):
             predicate_pairs = []
             for p in values:
                 # Build pairs of (id, arity)
-                if p[0] in parser.symbols['all']:
+                if p[:p.find('[')] in reserved:
                     print("ERROR: Reserved keyword or conflicting token detected in input file!")
                     return "FAIL"
                 predicate_pairs.append((p[:p.find('[')], int(p[p.find('[') + 1:p.find(']')])))
             values = predicate_pairs
             for v in values:
-                check = [fs in v[0] for fs in FORBIDDEN_SUBSTRINGS]
-                if True in check:
+                if FORBIDDEN_SUBSTRING.search(v[0]):
                     print("ERROR: Forbidden character was found in a value")
                     return "FAIL"
-                check = [c in string.ascii_letters + string.digits + '_' for c in v[0]]
-                if False in check:
+                if not PREDICATE_NAME.fullmatch(v[0]):
                     print("ERROR: Forbidden character was found in value")
                     return "FAIL"
-            if not len(values) == len(set(values)):
+            if not len(values) == len({x[0] for x in values}): # A name may only have one arity
                 print("ERROR: Duplicate values in same class.")
                 return "FAIL"
-            parser.symbols['all'] = parser.symbols['all'] + [x[0] for x in values]
+            reserved.update(x[0] for x in values)
 
-        elif not current_field == "formula": # add symbols to all (except for formula)
-            # Check if forbidden substrings are in values
+        else: # add symbols to all
+            # Check if forbidden substrings are in values, only the first character is checked against the class
+            first_character = FIRST_CHARACTER.get(current_field, FIRST_CHARACTER[None])
             for v in values:
-                check = [fs in v for fs in FORBIDDEN_SUBSTRINGS]
-                if True in check:
+                if FORBIDDEN_SUBSTRING.search(v):
                     print("ERROR: Forbidden character was found in a value")
                     return "FAIL"
-                if current_field in ["connectives", "quantifiers"]:
-                    check = [c in string.ascii_letters + string.digits + '\\_' for c in v[0]]
-                elif current_field == "equality":
-                    check = [c in string.ascii_letters + string.digits + '\\=_' for c in v[0]]
-                else:
-                    check = [c in string.ascii_letters + string.digits + '_' for c in v[0]]
-                if False in check:
+                if not first_character.match(v):
                     print("ERROR: Forbidden character was found in value")
                     return "FAIL"
             if not len(values) == len(set(values)):
                 print("ERROR: Duplicate values in same class.")
                 return "FAIL"
-            parser.symbols['all'] = parser.symbols['all'] + values
+            reserved.update(values)
 
         # also add symbols to relevant field
-        parser.symbols[current_field] = parser.symbols[current_field] + values
+        parser.symbols[current_field].extend(values)
 
-    # Last connective is always negation, so seperate connectives out
-    parser.symbols['connectives2'] = parser.symbols['connectives'][:-1]
-    parser.symbols['connectives1'] = [parser.symbols['connectives'][-1]]
-
-    if not set(seen_fields) == REQUIRED_FIELDS:
-        print("ERROR: Input file was missing fields!")
-        return "FAIL"
     if not len(parser.symbols['connectives']) == 5:
         print("ERROR: Input file was missing some connectives")
         return "FAIL"
@@ -503,49 +896,201 @@ def parse_file(path, parser):
     if not len(parser.symbols['equality']) == 1:
         print("ERROR: Input file was missing some equalities")
         return "FAIL"
+
+    # Last connective is always negation, so seperate connectives out
+    parser.symbols['connectives2'] = parser.symbols['connectives'][:-1]
+    parser.symbols['connectives1'] = [parser.symbols['connectives'][-1]]
+    compile_symbols(parser)
+    if profile is not None:
+        profile.lap("validate")
+    if cache_path:
+        save_compiled(parser, cache_path)
+        if profile is not None:
+            profile.lap("cache")
     return "OK"
 
-# Function to print the production rules based on the seen symbols
-def print_productions(parser):
-    print_productions = []
+# Function to hash the raw signature lines, identifying a signature in the caches
+def signature_hash(lines):
+    h = hashlib.sha256(CACHE_VERSION.encode())
+    for line in lines:
+        h.update(line)
+    return h.hexdigest()
 
-    print_productions.append("var -> " + ' | '.join(parser.symbols['variables']))
-    print_productions.append("const -> " + ' | '.join(parser.symbols['constants']))
-    print_productions.append("eq -> " + ' | '.join(parser.symbols['equality']))
-    print_productions.append("conn1 -> " + ' | '.join(parser.symbols['connectives1']))
-    print_productions.append("conn2 -> " + ' | '.join(parser.symbols['connectives2']))
-    print_productions.append("quan -> " + ' | '.join(parser.symbols['quantifiers']))
-    print_productions.append("pred -> " + ' | '.join(
-        x[0] + ' ( ' + 'var , ' * (x[1]-1) + 'var )'
-        for x in parser.symbols['predicates']
-    ))
-    print_productions.append("form -> pred | ( var eq var ) | ( var eq const ) | ( const eq var ) | ( const eq const ) | ( form conn2 form ) | quan var form | conn1 form2")
+# Loads the symbols saved by save_compiled into the parser and compiles its Grammar from them
+# Entries are plain data, a cache directory others can write to can give a wrong signature but never run code
+# Returns False if there is no usable cache entry
+def load_compiled(parser, path):
+    try:
+        with open(path, mode='r') as f:
+            symbols = json.load(f)
+        if not (type(symbols) is dict and CACHED_FIELDS <= symbols.keys()):
+            return False
+        symbols['predicates'] = [(name, arity) for name, arity in symbols['predicates']] # JSON has no tuples
+        parser.symbols.update(symbols)
+        compile_symbols(parser)
+    except Exception:
+        return False
+    return True
 
-    print('\n'.join(print_productions))
-    f = open('productions.txt', mode='w')
-    f.write('\n'.join(print_productions))
-    f.close()
+# Saves the symbols of the parser's Grammar to the cache file at path as JSON
+# The file is written next to its final name and renamed so readers never see a partial entry
+def save_compiled(parser, path):
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='w') as f:
+            json.dump({k: list(v) for k, v in parser.grammar.symbols.items()}, f)
+        os.replace(temp_path, path)
+    except OSError:
+        print("WARNING: Failed to write the signature cache")
 
-# Entry point to program
-if __name__ == '__main__':
-    # Print a helpful message!
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Invalid arguments!")
-        print("python {sys.argv[0]} input_file [log_file]")
-        exit()
-    
-    parser = PredictiveParser()
-    file_path = sys.argv[1]
-    log_path = "log.txt"
-    # if log file path is specified, replace default
-    if len(sys.argv) == 3:
-        log_path = sys.argv[2]
 
-    # Parse the specified file
-    if not parse_file(file_path, parser) == "OK":
-        exit()
+# Function to split formula text into tokens
+def tokenize_formula(text):
+    return FORMULA_TOKEN.findall(text)
 
-    # Define mappings between error codes and error messages
+# Lexer over the formula in data[start:end], data is either bytes (such as the mapped input file) or text
+# The text is scanned once by the token regex in fixed size chunks, bytes are decoded as they are read,
+# so memory stays flat. Iterating it yields the tokens and can be repeated
+# The match of the token last yielded is kept so the line and column of an error can be worked out
+# from its chunk alone, without scanning the formula again
+class FormulaLexer:
+    def __init__(self, data, start=0, end=None, line=1, column=0):
+        self.data = data
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.first_line = line # Line of data[start] in the file
+        self.first_column = column # Characters before data[start] on its line
+        self.match = None # Match of the last token yielded
+        self.chunk = None # (text, offset, line, line start) of the chunk being scanned
+        self.matched_chunk = None # The same for the last chunk that held a token
+        self.done = False # True once every token was yielded
+        self.profile = None # Optional Profile, the time spent lexing is added to its tokenize phase
+
+    # Line and column (both counted from 1) of the last token, or just after it once all were read
+    def location(self):
+        if self.match is None:
+            return self.first_line, self.first_column + 1
+        text, base, line, line_start = self.chunk if self.match.string is self.chunk[0] else self.matched_chunk
+        offset = self.match.end() if self.done else self.match.start()
+        newlines = text.count('\n', 0, offset)
+        if newlines:
+            line += newlines
+            line_start = base + text.rfind('\n', 0, offset) + 1
+        return line, base + offset - line_start + 1
+
+    # Yields pairs of (text, final) with the formula text in chunks
+    def chunks(self):
+        if isinstance(self.data, str):
+            for position in range(self.start, self.end, CHUNK_SIZE):
+                yield self.data[position:min(position + CHUNK_SIZE, self.end)], False
+            yield '', True
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for position in range(self.start, self.end, CHUNK_SIZE):
+            yield decoder.decode(self.data[position:min(position + CHUNK_SIZE, self.end)]), False
+        yield decoder.decode(b'', final=True), True
+
+    def __iter__(self):
+        if self.profile is not None:
+            return self.timed(self.profile)
+        return self.scan()
+
+    # Yields the tokens of scan, adding the time spent lexing them to the tokenize phase of profile
+    # so the lexer is timed while the parser reads the tokens, and the formula is still only lexed once
+    def timed(self, profile):
+        clock = time.perf_counter
+        tokens = self.scan()
+        spent = 0.0
+        try:
+            while True:
+                start = clock()
+                token = next(tokens, None)
+                spent += clock() - start
+                if token is None:
+                    return
+                yield token
+        finally: # Also when the parser stops at an error before the last token
+            profile.timings["tokenize"] += spent
+
+    # Yields the tokens of the formula
+    def scan(self):
+        self.match = None
+        self.done = False
+        line, line_start, base = self.first_line, -self.first_column, 0
+        pending = '' # Token at the end of a chunk, it may continue in the next one
+        for text, final in self.chunks():
+            text = pending + text
+            tail = None if final else TOKEN_TAIL.search(text)
+            cut = len(text) if tail is None else tail.start()
+            self.chunk = (text, base, line, line_start)
+            for match in FORMULA_TOKEN.finditer(text, 0, cut):
+                self.match = match
+                yield match.group()
+            if self.match is not None and self.match.string is text:
+                self.matched_chunk = self.chunk
+            newlines = text.count('\n', 0, cut)
+            if newlines:
+                line += newlines
+                line_start = base + text.rfind('\n', 0, cut) + 1
+            pending = text[cut:]
+            base += cut
+        self.done = True
+
+# Iterable over the tokens of the formula field, read lazily from the input file when streaming
+def formula_tokens(parser):
+    if parser.formula_source is None:
+        return parser.symbols['formula']
+    return FormulaLexer(*parser.formula_source)
+
+# Writes the tokens separated by spaces, the token at index is written using mark
+def write_tokens(out, tokens, index=None, mark="{} "):
+    for i, x in enumerate(tokens):
+        out.write(mark.format(x) if i == index else f"{x} ")
+
+# Function to stream a parse tree to out in graphviz DOT format, one line per node and edge
+# Subtrees below max_depth, or reached after max_nodes nodes were written, are collapsed into one
+# placeholder giving the number of hidden nodes. Shared nodes of a SharedTree are written once
+def write_dot(out, tree, max_depth=None, max_nodes=None):
+    seen = set() if isinstance(tree, SharedTree) else None # Nodes already written, only needed for DAGs
+    written = 0
+    collapsed = 0
+    out.write("digraph parse_tree {\n\tnode [shape=box];\n")
+    stack = [(tree.root, 0, None)] # Triples of (node, depth, parent node)
+    while stack:
+        node, depth, parent = stack.pop()
+        if seen is not None and node in seen:
+            out.write(f"\tn{parent} -> n{node};\n")
+            continue
+        if (max_depth is not None and depth > max_depth) or (max_nodes is not None and written >= max_nodes):
+            collapsed += 1
+            out.write(f'\tc{collapsed} [label="... ({count_nodes(tree, node)} hidden)", shape=plaintext];\n')
+            if parent is not None:
+                out.write(f"\tn{parent} -> c{collapsed};\n")
+            continue
+        written += 1
+        if seen is not None:
+            seen.add(node)
+        label = tree.label(node).replace('\\', '\\\\').replace('"', '\\"')
+        out.write(f'\tn{node} [label="{label}"];\n')
+        if parent is not None:
+            out.write(f"\tn{parent} -> n{node};\n")
+        stack.extend((child, depth + 1, node) for child in reversed(list(tree.children(node))))
+    out.write("}\n")
+
+# Counts the distinct nodes in the subtree of node without recursing
+def count_nodes(tree, node):
+    seen = {node}
+    stack = [node]
+    while stack:
+        for child in tree.children(stack.pop()):
+            if not child in seen:
+                seen.add(child)
+                stack.append(child)
+    return len(seen)
+
+# Function to build the mapping between error codes and error messages
+def error_messages(parser):
     ERROR_DICT = defaultdict(lambda: "GENERIC - Generic Syntax Error.")
     ERROR_DICT['EMPTY'] = "EMPTY - Input string was empty."
     ERROR_DICT['UNKNOWN_SYMBOL'] = "UNKNOWN_SYMBOL - Unknown reference to symbol."
@@ -561,28 +1106,557 @@ if __name__ == '__main__':
     ERROR_DICT['EX_BRACKET'] = "EX_BRACKET - Expected a bracket at this Position."
     ERROR_DICT['EX_COMMA'] = "EX_COMMA - Expected a comma at this Position."
     ERROR_DICT['EX_END'] = "EX_END - Expected end of string, but encountered more tokens."
-    
+    return ERROR_DICT
+
+# Describes where an error is, by token index and by line and column in the input file when known
+def error_position(index, location):
+    if location is None:
+        return f"Position {index}"
+    return f"Position {index} (line {location[0]}, column {location[1]})"
+
+# Function to cut the tokens around each syntax error of the last parse out of the formula
+# The formula is read once however many errors there are, so reporting every error stays linear in its length
+# Returns (tokens, position of the error among them, cut before, cut after) for each entry of the error list
+def error_windows(parser):
+    errors = parser.error_list
+    windows = [[] for _ in errors]
+    first = [max(0, index - ERROR_CONTEXT) for _, index, _, _ in errors]
+    cut_after = [False] * len(errors)
+    order = sorted(range(len(errors)), key=lambda k: errors[k][1])
+    done = 0 # Windows in order that are complete
+    started = 0 # Windows in order that have begun
+    for position, token in enumerate(formula_tokens(parser)):
+        while done < len(order) and errors[order[done]][1] + ERROR_CONTEXT < position:
+            cut_after[order[done]] = True
+            done += 1
+        if done == len(order):
+            break
+        while started < len(order) and first[order[started]] <= position:
+            started += 1
+        for k in order[done:started]:
+            windows[k].append(token)
+    for k, (_, index, lookahead, _) in enumerate(errors):
+        if lookahead is END: # Show the end of input if the error is there
+            windows[k].append("")
+    return [(windows[k], errors[k][1] - first[k], first[k] > 0, cut_after[k]) for k in range(len(errors))]
+
+# Writes a window from error_windows, the token at the error is written using mark
+def write_window(out, window, mark):
+    tokens, index, cut_before, cut_after = window
+    if cut_before:
+        out.write("... ")
+    write_tokens(out, tokens, index, mark)
+    if cut_after:
+        out.write("... ")
+
+# Function to write the result of parsing the formula field to the log file
+# graph says whether tree.png is drawn for a valid formula
+def write_log(f, parser, code, ERROR_DICT, graph=True):
+    if code:
+        # If a syntax error, provide informtion, with error recovery there is one entry per error
+        for (syntax_code, index, lookahead, location), window in zip(parser.error_list, error_windows(parser)):
+            f.write(f"ERROR:\tSyntax Error! {error_position(index, location)}\n")
+            if not syntax_code == "EMPTY":
+                f.write('\t')
+                write_window(f, window, ">>> {} <<< ")
+                f.write('\n')
+            f.write(f"\t{ERROR_DICT[syntax_code]}\n")
+    elif parser.build_tree and graph:
+        f.write(f"INFO:\tValid Input String! See tree.png for parse tree\n")
+    else:
+        f.write(f"INFO:\tValid Input String!\n")
+
+# Generator over the formulas to validate in batch mode as pairs of (result record, formula)
+# Reads one formula per line (or one JSON object per line with a "formula" key when jsonl is set)
+# A line that holds no usable formula gives a FAIL record and None, so the rest of the batch still runs
+def batch_formulas(lines, jsonl=False):
+    for number, line in enumerate(lines, 1):
+        if jsonl:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield {'id': number, 'status': "FAIL", 'message': f"Invalid JSON: {e}"}, None
+                continue
+            if not isinstance(record, dict):
+                yield {'id': number, 'status': "FAIL", 'message': "Records must be JSON objects"}, None
+                continue
+            formula = record.get('formula')
+            result = {'id': record.get('id', number)}
+            if isinstance(formula, str) or isinstance(formula, list) and all(isinstance(x, str) for x in formula):
+                yield result, formula
+            else:
+                result['status'], result['message'] = "FAIL", "Record needs a formula, a string or a list of tokens"
+                yield result, None
+        else:
+            yield {'line': number}, line
+
+# Parses one formula given as text or a list of tokens and returns (status, code, position)
+def check_formula(parser, formula):
+    tokens = tokenize_formula(formula) if isinstance(formula, str) else formula
+    code = parser.parse(tokens)
+    return ("ERROR" if code else "OK", parser.syntax_code, parser.index)
+
+# Function to validate many formulas against the already loaded signature
+# Streams one JSON result record per formula to out, in input order
+# With more than one job the formulas are spread over a process pool in chunks
+def validate_batch(parser, lines, out, jsonl=False, jobs=1):
+    def write_result(result, outcome):
+        if outcome is not None: # Lines without a formula already hold their FAIL status
+            result['status'], result['code'], result['position'] = outcome
+        out.write(json.dumps(result) + '\n')
+
+    if jobs == 1:
+        for result, formula in batch_formulas(lines, jsonl):
+            write_result(result, None if formula is None else check_formula(parser, formula))
+        return
+    from concurrent.futures import ProcessPoolExecutor # Only loaded when worker processes are used
+    # Workers receive the compiled parser once when they start, not with every chunk
+    workers = jobs or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(parser,)) as executor:
+        chunks = parallel_chunks(executor, _check_chunk, batch_formulas(lines, jsonl), PARALLEL_CHUNK_SIZE, 4 * workers)
+        for chunk, outcomes in chunks:
+            for (result, _), outcome in zip(chunk, outcomes):
+                write_result(result, outcome)
+
+# Function to validate many independent input files, each with its own signature and formula
+# Every file gets a header line with its path and status (OK, ERROR for a syntax error or FAIL if the file
+# could not be loaded) followed by the log a run with --validate-only would write, all in input order
+# Console messages are printed in the same order, each line starting with the path of its file
+# Files are parsed with the recover, specialise and parse_cache options of options, a PredictiveParser
+def validate_files(paths, out, options, jobs=1, cache_dir=None):
+    def write_result(path, status, console, log):
+        sys.stdout.writelines(f"{path}: {line}\n" for line in console.splitlines())
+        out.write(f"FILE:\t{path}\t{status}\n")
+        out.write(log)
+
+    if jobs == 1:
+        for path in paths:
+            write_result(path, *_validate_file(path, options, cache_dir))
+        return
+    from concurrent.futures import ProcessPoolExecutor # Only loaded when worker processes are used
+    workers = jobs or os.cpu_count()
+    # Workers receive the options once when they start, so each keeps its own parse cache between chunks
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options,)) as executor:
+        validate = partial(_validate_files, cache_dir=cache_dir)
+        for chunk, outcomes in parallel_chunks(executor, validate, paths, FILE_CHUNK_SIZE, 4 * workers):
+            for path, outcome in zip(chunk, outcomes):
+                write_result(path, *outcome)
+
+# Runs fn over chunks of items in the executor and yields (chunk, results) in input order
+# At most window chunks are in flight, so items are consumed as a stream
+def parallel_chunks(executor, fn, items, chunk_size, window):
+    items = iter(items)
+    pending = deque()
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if chunk:
+            pending.append((chunk, executor.submit(fn, chunk)))
+        if not pending:
+            return
+        if not chunk or len(pending) >= window:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+# Worker side of the parallel drivers, these must live at module level so they can be pickled
+_worker_parser = None
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+def _check_chunk(chunk):
+    return [None if formula is None else check_formula(_worker_parser, formula) for _, formula in chunk]
+
+def _validate_files(paths, cache_dir=None):
+    return [_validate_file(path, _worker_parser, cache_dir) for path in paths]
+
+# Validates a single input file and returns its status along with the (console, log) text it produces
+def _validate_file(path, options, cache_dir=None):
+    console = io.StringIO()
+    log = io.StringIO()
+    status = "FAIL"
+    with redirect_stdout(console):
+        parser = PredictiveParser(build_tree=False, parse_cache=options.parse_cache, recover=options.recover,
+                                  specialise=options.specialise)
+        if parse_file(path, parser, stream=True, cache_dir=cache_dir) == "OK":
+            code = parser.parse(formula_tokens(parser))
+            status = "ERROR" if code else "OK"
+            write_log(log, parser, code, error_messages(parser))
+    return status, console.getvalue(), log.getvalue()
+
+# Function to build a recogniser specialised to the signature of a Grammar
+# The grammar is fixed so it is written out by hand, only the symbol sets and predicate arities vary
+# and they are baked into the closure as frozensets and a dict, nothing is looked up per token
+# Returns a function taking the tokens and returning how many there were if they form a valid formula, otherwise 0
+# so token streams without a length, such as a FormulaLexer, get an index too
+# Each Grammar builds its recogniser once and keeps it (see Grammar.recogniser), so it is freed with the grammar
+def specialised_recogniser(grammar):
+    def category(name):
+        return frozenset(token for token, (c, _, _) in grammar.table.items() if c == name)
+    VARS = category('variables')
+    TERMS = VARS | category('constants')
+    EQS = category('equality')
+    CONN1S = category('connectives1')
+    CONN2S = category('connectives2')
+    QUANS = category('quantifiers')
+    PREFIXES = CONN1S | QUANS
+    ARITY = {token: max(arity, 1) for token, (c, arity, _) in grammar.table.items() if c == 'predicates'}
+    AFTER_LEFT, AFTER_RIGHT = 0, 1 # What an open ( form conn2 form ) still expects
+
+    def recognise(tokens):
+        counter = count(1)
+        tokens = compress(tokens, counter) # Draws one number per token read, so counter ends one past the last
+        stack = [] # Open binary formulas
+        t = next(tokens, END)
+        while True:
+            # Parse a formula starting at t
+            while t in PREFIXES:
+                if t in QUANS and not next(tokens, END) in VARS:
+                    return 0
+                t = next(tokens, END)
+            if t in ARITY:
+                if not next(tokens, END) == '(':
+                    return 0
+                for i in range(ARITY[t]):
+                    if i and not next(tokens, END) == ',':
+                        return 0
+                    if not next(tokens, END) in VARS:
+                        return 0
+                if not next(tokens, END) == ')':
+                    return 0
+            elif t == '(':
+                t = next(tokens, END)
+                if not t in TERMS:
+                    stack.append(AFTER_LEFT)
+                    continue
+                if not next(tokens, END) in EQS or not next(tokens, END) in TERMS or not next(tokens, END) == ')':
+                    return 0
+            else:
+                return 0
+            # The formula is complete, close the binary formulas it finishes
+            t = next(tokens, END)
+            while stack:
+                if stack[-1] == AFTER_LEFT:
+                    if not t in CONN2S:
+                        return 0
+                    stack[-1] = AFTER_RIGHT
+                    t = next(tokens, END)
+                    break
+                if not t == ')':
+                    return 0
+                stack.pop()
+                t = next(tokens, END)
+            else:
+                return next(counter) - 1 if t is END else 0
+
+    return recognise
+
+# Function to compile the validated symbols into the Grammar of the parser
+# Every token maps to (category, arity, id) so classifying it is one dict lookup
+def compile_symbols(parser):
+    table = {}
+    tokens = []
+
+    def intern(token, category, arity=0):
+        table[token] = (category, arity, len(tokens))
+        tokens.append(token)
+
+    for token in [',', '(', ')']:
+        intern(token, 'punctuation')
+    for category in ['variables', 'constants', 'equality', 'connectives1', 'connectives2', 'quantifiers']:
+        for token in parser.symbols[category]:
+            intern(token, category)
+    for name, arity in parser.symbols['predicates']:
+        intern(name, 'predicates', arity)
+
+    productions = build_productions(parser)
+    symbols = {k: v for k, v in parser.symbols.items() if not k in ('formula', 'all')}
+    parser.grammar = Grammar(symbols, table, tokens, productions, build_parse_table(left_factor(productions), FORM),
+                             FORM, parser.signature_hash)
+
+# Function to build the grammar productions from the signature
+# Maps each nonterminal to its alternatives, each a tuple of grammar symbols
+def build_productions(parser):
+    productions = {}
+    productions[VAR] = [(x,) for x in parser.symbols['variables']]
+    productions[CONST] = [(x,) for x in parser.symbols['constants']]
+    productions[EQ] = [(x,) for x in parser.symbols['equality']]
+    productions[CONN1] = [(x,) for x in parser.symbols['connectives1']]
+    productions[CONN2] = [(x,) for x in parser.symbols['connectives2']]
+    productions[QUAN] = [(x,) for x in parser.symbols['quantifiers']]
+    productions[PRED] = [
+        (x[0], '(') + (VAR, ',') * (x[1]-1) + (VAR, ')')
+        for x in parser.symbols['predicates']
+    ]
+    productions[FORM] = [
+        (PRED,),
+        ('(', VAR, EQ, VAR, ')'), ('(', VAR, EQ, CONST, ')'), ('(', CONST, EQ, VAR, ')'), ('(', CONST, EQ, CONST, ')'),
+        ('(', FORM, CONN2, FORM, ')'),
+        (QUAN, VAR, FORM),
+        (CONN1, FORM),
+    ]
+    return productions
+
+# Function to left factor productions whose alternatives start with the same symbol
+# The new tail nonterminals do not appear in the parse tree
+def left_factor(productions):
+    factored = {}
+    names = set(nt.name for nt in productions)
+    pending = list(productions.items())
+    while pending:
+        nt, alternatives = pending.pop(0)
+        groups = {} # First symbol -> alternatives starting with it
+        for alternative in alternatives:
+            groups.setdefault(alternative[:1], []).append(alternative)
+        factored[nt] = []
+        for group in groups.values():
+            if len(group) == 1:
+                factored[nt].append(group[0])
+                continue
+            # Find the longest common prefix of the group
+            prefix = 0
+            while all(len(x) > prefix and x[prefix] == group[0][prefix] for x in group):
+                prefix += 1
+            name = nt.name + "'"
+            while name in names:
+                name += "'"
+            names.add(name)
+            tails = [x[prefix:] for x in group]
+            tail = NonTerminal(name, error=expected_error(tails))
+            factored[nt].append(group[0][:prefix] + (tail,))
+            pending.append((tail, tails))
+    return factored
+
+# Error code for a nonterminal that cannot be expanded, based on what its alternatives start with
+def expected_error(alternatives):
+    firsts = set(x[0] for x in alternatives if x)
+    if firsts == {VAR, CONST}:
+        return "EX_VC"
+    codes = set(x.error if type(x) is NonTerminal else TERMINAL_ERRORS.get(x, "UNEX_SYMBOL") for x in firsts)
+    return codes.pop() if len(codes) == 1 else "UNEX_SYMBOL"
+
+# FIRST set of a sequence of grammar symbols and whether it can derive the empty string
+def sequence_first(symbols, first, nullable):
+    result = set()
+    for symbol in symbols:
+        if not type(symbol) is NonTerminal:
+            result.add(symbol)
+            return result, False
+        result |= first[symbol]
+        if not symbol in nullable:
+            return result, False
+    return result, True
+
+# Computes the FIRST sets and nullable nonterminals by iterating to a fixed point
+def first_sets(productions):
+    first = {nt: set() for nt in productions}
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for nt, alternatives in productions.items():
+            for alternative in alternatives:
+                symbols, empty = sequence_first(alternative, first, nullable)
+                if not symbols <= first[nt]:
+                    first[nt] |= symbols
+                    changed = True
+                if empty and not nt in nullable:
+                    nullable.add(nt)
+                    changed = True
+    return first, nullable
+
+# Computes the FOLLOW sets by iterating to a fixed point
+def follow_sets(productions, first, nullable, start):
+    follow = {nt: set() for nt in productions}
+    follow[start].add(END)
+    changed = True
+    while changed:
+        changed = False
+        for nt, alternatives in productions.items():
+            for alternative in alternatives:
+                for i, symbol in enumerate(alternative):
+                    if not type(symbol) is NonTerminal:
+                        continue
+                    symbols, empty = sequence_first(alternative[i+1:], first, nullable)
+                    if empty:
+                        symbols = symbols | follow[nt]
+                    if not symbols <= follow[symbol]:
+                        follow[symbol] |= symbols
+                        changed = True
+    return follow
+
+# Builds the LL(1) parse table from FIRST and FOLLOW sets
+# Alternatives are stored reversed so they can be pushed straight onto the parse stack
+def build_parse_table(productions, start):
+    first, nullable = first_sets(productions)
+    follow = follow_sets(productions, first, nullable, start)
+    parse_table = {nt: {} for nt in productions}
+    for nt, alternatives in productions.items():
+        for alternative in alternatives:
+            lookaheads, empty = sequence_first(alternative, first, nullable)
+            if empty:
+                lookaheads = lookaheads | follow[nt]
+            for token in lookaheads:
+                if token in parse_table[nt]:
+                    raise ValueError(f"Grammar is not LL(1), conflict on {token} for {nt}")
+                parse_table[nt][token] = alternative[::-1]
+    return parse_table
+
+# Function to print the production rules based on the seen symbols
+def print_productions(parser):
+    print_productions = []
+
+    for nt, alternatives in parser.productions.items():
+        print_productions.append(f"{nt} -> " + ' | '.join(
+            ' '.join(str(x) for x in alternative)
+            for alternative in alternatives
+        ))
+
+    print('\n'.join(print_productions))
+    f = open('productions.txt', mode='w')
+    f.write('\n'.join(print_productions))
+    f.close()
+
+# Entry point to program
+if __name__ == '__main__':
+    # Parse the command line arguments, argparse prints a helpful message on error
+    arg_parser = argparse.ArgumentParser(description="Predictive parser for first order logic formulas")
+    arg_parser.add_argument('input_file', help="Path to input file")
+    arg_parser.add_argument('log_file', nargs='?', default="log.txt", help="Path to the logging file (default: log.txt)")
+    arg_parser.add_argument('--validate-only', action='store_true',
+                            help="Only accept or reject the formula, no parse tree is built or drawn")
+    arg_parser.add_argument('--all-errors', action='store_true',
+                            help="Recover from syntax errors and report every error in the formula, not just the first")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="Time each phase and count parser steps, written as JSON to profile.json next to the log")
+    arg_parser.add_argument('--specialise', action='store_true',
+                            help="With --validate-only or --batch, check formulas with a recogniser specialised to the signature")
+    arg_parser.add_argument('--no-graph', action='store_true',
+                            help="Do not draw tree.png, the plotting libraries are then never imported")
+    arg_parser.add_argument('--dot', metavar='FILE',
+                            help="Also write the parse tree to FILE in graphviz DOT format, without matplotlib")
+    arg_parser.add_argument('--max-depth', metavar='N', type=int,
+                            help="Collapse subtrees deeper than N in the --dot output")
+    arg_parser.add_argument('--max-nodes', metavar='N', type=int,
+                            help="Collapse the rest of the tree after N nodes in the --dot output")
+    arg_parser.add_argument('--cnf', metavar='FILE',
+                            help="Also write the clausal normal form of a valid formula to FILE in TPTP format")
+    arg_parser.add_argument('--share-subtrees', action='store_true',
+                            help="Build the parse tree as a DAG where identical subformulas share one node")
+    arg_parser.add_argument('--batch', metavar='FORMULAS',
+                            help="Validate every formula in FORMULAS ('-' for stdin) against the signature in input_file, "
+                                 "writing one JSON record per formula to log_file ('-' for stdout)")
+    arg_parser.add_argument('--jsonl', action='store_true',
+                            help="Batch formulas are JSON objects with a \"formula\" key (and optional \"id\") instead of plain lines")
+    arg_parser.add_argument('--file-list', action='store_true',
+                            help="input_file lists input files, one path per line ('-' for stdin). Each is validated on its own "
+                                 "and their logs are written to log_file in order, each after a line with its path and status")
+    arg_parser.add_argument('--jobs', type=int, default=1,
+                            help="Number of worker processes for --batch and --file-list (0 for one per core, default: 1)")
+    arg_parser.add_argument('--parse-cache', metavar='N', type=int, default=0,
+                            help="Remember the results of the last N distinct formulas so repeats are not reparsed (default: 0, off)")
+    arg_parser.add_argument('--cache-dir', metavar='DIR',
+                            help="Cache compiled signatures in DIR, keyed by a hash of the signature, so unchanged signatures skip validation")
+    args = arg_parser.parse_args()
+
+    parse_cache = ParseCache(args.parse_cache) if args.parse_cache > 0 else None
+    profile = Profile() if args.profile else None
+    parser = PredictiveParser(build_tree=not (args.validate_only or args.batch), share_subtrees=args.share_subtrees,
+                              parse_cache=parse_cache, recover=args.all_errors, profile=profile,
+                              specialise=args.specialise)
+    file_path = args.input_file
+    log_path = args.log_file
+    profile_path = os.path.join(os.path.dirname(log_path), "profile.json") # Written next to the log
+
+    # Many independent input files, each validated as if it was run on its own
+    if args.file_list:
+        lines = sys.stdin if file_path == '-' else open(file_path, mode='r')
+        out = sys.stdout if log_path == '-' else open(log_path, mode='w')
+        validate_files((l.strip() for l in lines if l.strip()), out, parser, jobs=args.jobs, cache_dir=args.cache_dir)
+        if not lines is sys.stdin:
+            lines.close()
+        if not out is sys.stdout:
+            out.close()
+        exit()
+
+    # Parse the specified file
+    if not parse_file(file_path, parser, require_formula=not args.batch, stream=not args.batch, cache_dir=args.cache_dir) == "OK":
+        exit()
+
+    # Batch mode, the signature and grammar are loaded once and reused for every formula
+    if args.batch:
+        lines = sys.stdin if args.batch == '-' else open(args.batch, mode='r')
+        out = sys.stdout if log_path == '-' else open(log_path, mode='w')
+        validate_batch(parser, lines, out, jsonl=args.jsonl, jobs=args.jobs)
+        if not lines is sys.stdin:
+            lines.close()
+        if not out is sys.stdout:
+            out.close()
+        if profile is not None:
+            profile.write(profile_path)
+        exit()
+
+    # Define mappings between error codes and error messages
+    ERROR_DICT = error_messages(parser)
+
     # Print the grammar productions
+    if profile is not None:
+        profile.lap()
     print("~~ PRODUCTIONS ~~")
     print_productions(parser)
     print("~~~~~~~~~~~~~~~~~\n")
+    if profile is not None:
+        profile.lap("print_productions")
 
+    # Parse the formula, its tokens are streamed from the input file
+    tokens = formula_tokens(parser)
+    if profile is not None and type(tokens) is FormulaLexer:
+        tokens.profile = profile # Tokenizing is timed as the parser reads the tokens
+    code = parser.parse(tokens)
     f = open(log_path, mode='w')
-    # Parse the formula
-    if parser.parse(parser.symbols['formula']):
+    write_log(f, parser, code, ERROR_DICT, graph=not args.no_graph)
+    f.close()
+    if profile is not None:
+        profile.lap("write_log")
+
+    if code:
         # If a syntax error, provide informtion
-        f.write(f"ERROR:\tSyntax Error! Position {parser.index}\n")
-        if not parser.syntax_code == "EMPTY":
-            f.write('\t' + ''.join(f">>> {x} <<< " if i == parser.index else f"{x} " for i, x in enumerate(parser.string)) + '\n')
-        f.write(f"\t{ERROR_DICT[parser.syntax_code]}\n")
-        print(f"ERROR:\tSyntax Error! Position {parser.index}")
-        if not parser.syntax_code == "EMPTY":
-            print('\t' + ''.join(f"\33[41m{x} \033[0m" if i == parser.index else f"{x} " for i, x in enumerate(parser.string)))
-        print(f"\t{ERROR_DICT[parser.syntax_code]}")
+        for (syntax_code, index, lookahead, location), window in zip(parser.error_list, error_windows(parser)):
+            print(f"ERROR:\tSyntax Error! {error_position(index, location)}")
+            if not syntax_code == "EMPTY":
+                sys.stdout.write('\t')
+                write_window(sys.stdout, window, "\33[41m{} \033[0m")
+                print()
+            print(f"\t{ERROR_DICT[syntax_code]}")
     else:
         # If a valid formula, print out the graph
-        print(f"INPUT:\t{' '.join(parser.symbols['formula'])}")
-        print("INFO:\tValid input string. See tree.png for parse tree")
-        f.write(f"INFO:\tValid Input String! See tree.png for parse tree\n")
-        parser.print_graph()
-    f.close()
+        sys.stdout.write("INPUT:\t")
+        write_tokens(sys.stdout, formula_tokens(parser))
+        print()
+        if parser.build_tree and not args.no_graph:
+            print("INFO:\tValid input string. See tree.png for parse tree")
+            if profile is not None:
+                profile.lap()
+            parser.print_graph()
+            if profile is not None:
+                profile.lap("print_graph")
+        else:
+            print("INFO:\tValid input string.")
+        if parser.build_tree and args.dot:
+            if profile is not None:
+                profile.lap()
+            with open(args.dot, mode='w') as f:
+                write_dot(f, parser.tree, max_depth=args.max_depth, max_nodes=args.max_nodes)
+            if profile is not None:
+                profile.lap("write_dot")
+            print(f"INFO:\tParse tree written to {args.dot}")
+        if parser.build_tree and args.cnf:
+            from normalform import clausal_form, write_tptp # Only loaded when clauses are wanted
+            with open(args.cnf, mode='w') as f:
+                write_tptp(f, clausal_form(parser))
+            print(f"INFO:\tClauses written to {args.cnf}")
+
+    if profile is not None:
+        profile.write(profile_path)
@@ -5,11 +5,21 @@
     Usage: python test.py your_program.py
             (assuming your_program has it's first argument as the input text file)
             (ie. you call your program by doing python your_program.py test.txt)
-            (If you cannot do this, edit line 99 to fit your arguments.)
+            (If you cannot do this, edit call_program to fit your arguments.)
 
     The program will then try many tests in quick succession. You will have to manually make sure the result
     matches the correct result as I have no way of knowing how your implementation works.
 
+    Usage: python test.py your_program.py --in-process [--jobs N] [--seed S]
+            (your_program must provide parse_file, PredictiveParser and formula_tokens like submission.py)
+
+    The cases are then run inside worker processes instead of one subprocess each, spread over every core
+    (or N workers). Each case has its own input file, results are checked automatically and only the
+    unexpected ones are printed. Checks of the program's Python interface (incremental reparsing, error
+    recovery, evaluate.py and the like) run afterwards, each skipped if the program or numpy does not provide it.
+
+    Mutated formulas in stages 4 and 5 that are still valid are replaced, so every case there must fail.
+
     Be aware that occasionally there may be false positives/negatives and bugs and may not test every case!
     (ie. not my fault if you fail)
 
@@ -17,9 +27,17 @@
 """
 
 import sys
+import os
+import io
 import subprocess
 import random
+import argparse
+import tempfile
+import importlib.util
+import itertools
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 import string
 
 BASE_VAR = ["VAR1", "VAR2", "VAR3", "VAR4", "VAR5"]
@@ -37,6 +55,58 @@ BASE_FORMULA = [
     "( ( ( CONST1 EQ CONST2 ) AND ( CONST1 EQ VAR1 ) ) IFF ( ( VAR1 EQ CONST1 ) AND ( VAR1 EQ VAR2 ) ) )".split()
 ]
 
+# Reference recogniser for formulas over the base symbols, independent of the program being tested
+# Used to throw away mutated formulas that are still valid, the grammar is small so it recurses
+def is_formula(tokens):
+    return formula_end(tokens, 0) == len(tokens)
+
+# Returns the index just after the formula over the base symbols starting at tokens[start], or None if there is none
+def formula_end(tokens, start):
+    arity = {pred: i + 1 for i, pred in enumerate(BASE_PRED)}
+    terms = BASE_VAR + BASE_CONST
+
+    def form(i):
+        t = tokens[i] if i < len(tokens) else None
+        if t in BASE_QUAN:
+            return form(i + 2) if i + 1 < len(tokens) and tokens[i + 1] in BASE_VAR else None
+        if t == BASE_CONN[-1]: # Negation is the last connective
+            return form(i + 1)
+        if t in arity:
+            end = i + 2 + 2 * arity[t]
+            args = tokens[i + 1:end]
+            if not len(args) == end - i - 1 or not args[0] == "(" or not args[-1] == ")":
+                return None
+            if any(not x in BASE_VAR for x in args[1::2]) or any(not x == "," for x in args[2:-1:2]):
+                return None
+            return end
+        if not t == "(":
+            return None
+        if i + 1 < len(tokens) and tokens[i + 1] in terms:
+            ok = tokens[i + 2:i + 5]
+            return i + 5 if len(ok) == 3 and ok[0] in BASE_EQ and ok[1] in terms and ok[2] == ")" else None
+        j = form(i + 1)
+        if j is None or not j < len(tokens) or not tokens[j] in BASE_CONN[:-1]:
+            return None
+        j = form(j + 1)
+        return j + 1 if j is not None and j < len(tokens) and tokens[j] == ")" else None
+
+    return form(start)
+
+# Generates a random valid formula over the base symbols, nested at most depth deep
+def random_formula(depth=4):
+    kind = random.randint(0, 5) if depth > 0 else random.randint(0, 1)
+    if kind == 0:
+        pred = random.randrange(len(BASE_PRED))
+        args = [random.choice(BASE_VAR) for _ in range(pred + 1)]
+        return [BASE_PRED[pred], "("] + " , ".join(args).split() + [")"]
+    if kind == 1:
+        return ["(", random.choice(BASE_VAR + BASE_CONST), BASE_EQ[0], random.choice(BASE_VAR + BASE_CONST), ")"]
+    if kind == 2:
+        return [random.choice(BASE_QUAN), random.choice(BASE_VAR)] + random_formula(depth - 1)
+    if kind == 3:
+        return [BASE_CONN[-1]] + random_formula(depth - 1)
+    return ["("] + random_formula(depth - 1) + [random.choice(BASE_CONN[:-1])] + random_formula(depth - 1) + [")"]
+
 def gen_sub(sub=True):
     sub_dict = {'(': '(', ')': ')', ',': ',',
                 ' ': ' ', '\t':'\t', '\n':'\n'}
@@ -67,13 +137,13 @@ def gen_sub(sub=True):
 
     return sub_dict
 
-def write_to_file(formula, sub_dict, ran_order=False, fields=None):
+def write_to_file(formula, sub_dict, ran_order=False, fields=None, path="test.txt"):
     FIELDS = [("variables", BASE_VAR), ("constants", BASE_CONST), ("predicates", BASE_PRED), ("equality", BASE_EQ), ("connectives", BASE_CONN), ("quantifiers", BASE_QUAN), ("formula", formula)]
     
     if fields:
         FIELDS = [x if x[0] not in fields else (fields[x[0]], x[1]) for x in FIELDS]
 
-    f = open("test.txt", mode='w')
+    f = open(path, mode='w')
     if ran_order: random.shuffle(FIELDS)
     
     for field in FIELDS:
@@ -94,32 +164,63 @@ def write_to_file(formula, sub_dict, ran_order=False, fields=None):
 
     f.close()
 
-def call_program(py_path, ex_pass=True):
+def call_program(py_path, ex_pass=True, path="test.txt"):
     print(f"This program should {'PASS' if ex_pass else 'FAIL'}")
-    subprocess.run(["python", py_path, "test.txt"])
+    subprocess.run(["python", py_path, path])
     print("\n")
 
-def main():
+# Program module loaded by each worker for the in-process harness
+program = None
+
+def load_program(py_path):
+    global program
+    spec = importlib.util.spec_from_file_location("program", py_path)
+    program = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(program)
+    # Modules next to the program (evaluate.py, normalform.py) import it by its own name, give them this copy
+    sys.modules.setdefault(os.path.splitext(os.path.basename(py_path))[0], program)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(py_path)))
+
+# Runs a single case inside this process, returns whether it passed and what it printed
+def run_in_process(path):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        parser = program.PredictiveParser(build_tree=False)
+        passed = program.parse_file(path, parser) == "OK"
+        if passed and parser.parse(program.formula_tokens(parser)):
+            passed = False
+            print(f"ERROR:\tSyntax Error! Position {parser.index} ({parser.syntax_code})")
+    return passed, output.getvalue()
+
+# Generates every case, each written to its own file in directory
+# Returns a list of (stage, note, path, ex_pass, message), note is printed before the case and message after it
+def gen_cases(directory):
+    cases = []
+    def add_case(formula, sub_dict, stage, ex_pass=True, note=None, message=None, append=None, **kwargs):
+        path = os.path.join(directory, f"test{len(cases)}.txt")
+        write_to_file(formula, sub_dict, path=path, **kwargs)
+        if append:
+            f = open(path, mode='a')
+            f.write(append)
+            f.close()
+        cases.append((stage, note, path, ex_pass, message))
+
     # Stage 1 - Just try the base
-    print("-- STAGE 1: Basic Input --")
+    stage = "-- STAGE 1: Basic Input --"
     sub_dict = gen_sub(sub=False)
     for formula in BASE_FORMULA:
-        write_to_file(formula, sub_dict)
-        call_program(sys.argv[1])
-    print("\n\n")
+        add_case(formula, sub_dict, stage)
 
     # Stage 2 - Random IDs
-    print("-- STAGE 2: Random Symbol Names --")
+    stage = "-- STAGE 2: Random Symbol Names --"
     STAGE2_IT = 3
     for _ in range(STAGE2_IT):
         sub_dict = gen_sub(sub=True)
         for formula in BASE_FORMULA:
-            write_to_file(formula, sub_dict, ran_order=True)
-            call_program(sys.argv[1])
-    print("\n\n")
+            add_case(formula, sub_dict, stage, ran_order=True)
 
     # Stage 3 - Add extra whitespace
-    print("-- STAGE 3: Extra Whitespace --")
+    stage = "-- STAGE 3: Extra Whitespace --"
     STAGE3_IT = 3
     NB_INSERTIONS = 10
     WHITESPACE = [' ', '\t', '\n']
@@ -133,55 +234,55 @@ def main():
             for i, ic in enumerate(insert_char):
                 formula = formula[:ic[0]+i] + [ic[1]] + formula[ic[0]+i:]
 
-            write_to_file(formula, sub_dict, ran_order=True)
-            call_program(sys.argv[1])
-    print("\n\n")
+            add_case(formula, sub_dict, stage, ran_order=True)
 
     # Stage 4 - Remove random parts of the formula 
-    # All of these should fail
-    print("-- STAGE 4: Randomly remove parts of formula --")
+    # All of these should fail, deletions that leave a valid formula are drawn again
+    stage = "-- STAGE 4: Randomly remove parts of formula --"
     STAGE4_IT = 5
     NB_DELETIONS = 1
     for _ in range(STAGE4_IT):
         sub_dict = gen_sub(sub=False)
-        for formula in BASE_FORMULA:
-            n = len(formula)
-            delete = random.sample(range(n), NB_DELETIONS)
-            delete.sort()
+        for base in BASE_FORMULA:
+            formula = base
+            while is_formula(formula):
+                n = len(base)
+                delete = random.sample(range(n), NB_DELETIONS)
+                delete.sort()
 
-            for i, d in enumerate(delete):
-                formula = formula[:d-i] + formula[d-i+1:]
+                formula = base
+                for i, d in enumerate(delete):
+                    formula = formula[:d-i] + formula[d-i+1:]
 
-            write_to_file(formula, sub_dict, ran_order=True)
-            call_program(sys.argv[1], ex_pass=False)
-    print("\n\n")
+            add_case(formula, sub_dict, stage, ex_pass=False, ran_order=True)
 
     # Stage 5 - Add random valid symbols
-    print("-- STAGE 5: Add random valid symbols --")
+    stage = "-- STAGE 5: Add random valid symbols --"
     STAGE5_IT = 5
     NB_INSERTIONS = 1
     # TODO: predicates <07-03-20> #
     INSERTION = BASE_VAR + BASE_CONST + BASE_EQ + BASE_CONN + BASE_QUAN + list('()')
     for _ in range(STAGE5_IT):
         sub_dict = gen_sub(sub=False)
-        for formula in BASE_FORMULA:
-            n = len(formula)
-            insert = random.sample(range(n), NB_INSERTIONS)
+        for base in BASE_FORMULA:
+            formula = base
+            while is_formula(formula): # Insertions that leave a valid formula are drawn again
+                n = len(base)
+                insert = random.sample(range(n), NB_INSERTIONS)
             
-            insert_char = [(x, INSERTION[random.randint(0, len(INSERTION)-1)]) for x in insert]
+                insert_char = [(x, INSERTION[random.randint(0, len(INSERTION)-1)]) for x in insert]
 
-            for i, ic in enumerate(insert_char):
-                formula = formula[:ic[0]+i] + [ic[1]] + formula[ic[0]+i:]
+                formula = base
+                for i, ic in enumerate(insert_char):
+                    formula = formula[:ic[0]+i] + [ic[1]] + formula[ic[0]+i:]
 
-            write_to_file(formula, sub_dict, ran_order=True)
-            call_program(sys.argv[1], ex_pass=False)
-    print("\n\n")
+            add_case(formula, sub_dict, stage, ex_pass=False, ran_order=True)
 
     # Stage 6 - Break Grammar Rules
     # invalid field names
     # duplicate field names
     # invalid characters in strings (eg, \ in variables)
-    print("-- STAGE 6: Break grammar rules --")
+    stage = "-- STAGE 6: Break grammar rules --"
     for formula in BASE_FORMULA:
         FIELD_SUB = [
             {"formula": "form"},
@@ -191,43 +292,40 @@ def main():
             {"predicates": "variables"}
         ]
 
-        print("- Trying Invalid Field Names -")
+        note = "- Trying Invalid Field Names -"
         for field in FIELD_SUB:
             sub_dict = gen_sub(sub=True)
-            write_to_file(formula, sub_dict, fields=field, ran_order=True)
-            call_program(sys.argv[1], ex_pass=False)
+            add_case(formula, sub_dict, stage, ex_pass=False, note=note, fields=field, ran_order=True)
+            note = None
 
-        print("- Trying Duplicate Field Names -")
         sub_dict = gen_sub(sub=True)
-        write_to_file(formula, sub_dict, ran_order=False)
-        f = open("test.txt", mode='a')
-        f.write("variables: VAR0\n")
-        f.close()
-        call_program(sys.argv[1], ex_pass=False)
+        add_case(formula, sub_dict, stage, ex_pass=False, note="- Trying Duplicate Field Names -",
+                 append="variables: VAR0\n", ran_order=False)
+
+        sub_dict = gen_sub(sub=True)
+        name = sub_dict['PRED1'][0]
+        sub_dict['PRED2'] = (name, f"{name}[2]")
+        add_case(formula, sub_dict, stage, ex_pass=False, note="- Trying a predicate declared with two arities -",
+                 ran_order=True)
 
-        print("- Trying invalid characters in strings -")
         sub_dict = gen_sub(sub=False)
         sub_dict['VAR1'] = f"\\{sub_dict['VAR1']}"
-        write_to_file(formula, sub_dict, ran_order=False)
-        call_program(sys.argv[1], ex_pass=False)
+        add_case(formula, sub_dict, stage, ex_pass=False, note="- Trying invalid characters in strings -", ran_order=False)
 
         sub_dict = gen_sub(sub=False)
         sub_dict['CONST1'] = f"={sub_dict['CONST1']}"
-        write_to_file(formula, sub_dict, ran_order=False)
-        call_program(sys.argv[1], ex_pass=False)
+        add_case(formula, sub_dict, stage, ex_pass=False, ran_order=False)
 
         sub_dict = gen_sub(sub=False)
         sub_dict['EXISTS'] = f"={sub_dict['EXISTS']}"
-        write_to_file(formula, sub_dict, ran_order=False)
-        call_program(sys.argv[1], ex_pass=False)
+        add_case(formula, sub_dict, stage, ex_pass=False, ran_order=False)
 
         # sub_dict = gen_sub(sub=False)
         # sub_dict['EQ'] = f"\\{sub_dict['EQ']}"
-        # write_to_file(formula, sub_dict, ran_order=False)
-        # call_program(sys.argv[1], ex_pass=False)
-    print("\n\n")
+        # add_case(formula, sub_dict, stage, ex_pass=False, ran_order=False)
 
     # Stage 7 - Targetted Formula Cases
+    stage = "-- STAGE 7: Targetted formula cases --"
     targetted_formulas = [
         ("VAR1 EQ VAR2".split(), False, "Must be surrounded by brackets"),
         ("NEG ( PRED1 ( VAR1 ) )".split(), False, "Unnessecary Brackets"),
@@ -242,9 +340,384 @@ def main():
 
     for formula in targetted_formulas:
         sub_dict = gen_sub(sub=False)
-        write_to_file(formula[0], sub_dict, ran_order=True)
-        call_program(sys.argv[1], ex_pass=formula[1])
-        print(f"This test has the following message attached to it:\n{formula[2]}\n")
+        add_case(formula[0], sub_dict, stage, ex_pass=formula[1], message=formula[2], ran_order=True)
+
+    return cases
+
+# Runs every case as its own subprocess, printing the output of each one to check by hand
+def run_subprocesses(py_path, cases):
+    current = None
+    for stage, note, path, ex_pass, message in cases:
+        if not stage == current:
+            if current:
+                print("\n\n")
+            print(stage)
+            current = stage
+        if note:
+            print(note)
+        call_program(py_path, ex_pass=ex_pass, path=path)
+        if message:
+            print(f"This test has the following message attached to it:\n{message}\n")
+
+# Runs every case in process across worker processes, only unexpected results are printed
+# Returns the number of unexpected results
+def run_in_processes(py_path, cases, jobs):
+    paths = [case[2] for case in cases]
+    if jobs == 1:
+        load_program(py_path)
+        results = [run_in_process(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(jobs or os.cpu_count(), initializer=load_program, initargs=(py_path,)) as executor:
+            results = list(executor.map(run_in_process, paths, chunksize=8))
+
+    unexpected = 0
+    for (stage, note, path, ex_pass, message), (passed, output) in zip(cases, results):
+        if passed == ex_pass:
+            continue
+        unexpected += 1
+        print(f"{stage} {note or ''}")
+        print(f"This program should {'PASS' if ex_pass else 'FAIL'} but it {'PASSED' if passed else 'FAILED'}")
+        f = open(path, mode='r')
+        print(f.read() + output)
+        f.close()
+        if message:
+            print(f"This test has the following message attached to it:\n{message}\n")
+    print(f"{len(cases) - unexpected} of {len(cases)} cases behaved as expected")
+    return unexpected
+
+# Labels of the tree from its root in preorder, walked through children so grafted trees compare too
+def tree_labels(tree):
+    labels = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        labels.append(tree.label(node))
+        stack.extend(reversed(list(tree.children(node))))
+    return labels
+
+# Loads a parser for the base symbols from a signature written to directory
+def base_parser(directory, **kwargs):
+    path = os.path.join(directory, "checks.txt")
+    write_to_file(BASE_FORMULA[0], gen_sub(sub=False), path=path)
+    parser = program.PredictiveParser(**kwargs)
+    with redirect_stdout(io.StringIO()):
+        program.parse_file(path, parser)
+    return parser
+
+# Incremental reparses must give the same result and tree as parsing the edited formula from scratch,
+# and must leave the caller's token list alone
+def check_reparse(directory):
+    failures = []
+    for _ in range(200):
+        parser = base_parser(directory)
+        tokens = random_formula()
+        parser.parse(tokens)
+        for _ in range(15):
+            spans = [(i, formula_end(tokens, i)) for i in range(len(tokens))]
+            spans = [span for span in spans if span[1] is not None]
+            if spans and random.random() < 0.7: # Swap a subformula for another, the formula stays valid
+                start, end = random.choice(spans)
+                new_tokens = random_formula(2)
+            else: # Replace a random run of tokens with random symbols
+                start = random.randrange(len(tokens))
+                end = min(len(tokens), start + random.randint(0, 3))
+                new_tokens = random.choices(BASE_VAR + BASE_CONN + BASE_QUAN + list('(),'), k=random.randint(0, 3))
+            held = list(parser.string)
+            edited = tokens[:start] + new_tokens + tokens[end:]
+            code = parser.reparse(start, end, new_tokens)
+            if not held == tokens:
+                failures.append(f"reparse changed the caller's tokens: {' '.join(tokens)}")
+            full = base_parser(directory)
+            expected = full.parse(edited)
+            got = (code, parser.syntax_code, parser.index, None if code else tree_labels(parser.tree))
+            want = (expected, full.syntax_code, full.index, None if expected else tree_labels(full.tree))
+            if not got == want:
+                failures.append(f"reparse of {' '.join(tokens)} with {start}:{end} = {' '.join(new_tokens)} "
+                                f"gave {got[:3]}, parsing it whole gave {want[:3]}")
+            if not edited:
+                break
+            tokens = edited
+    return failures
+
+# The recogniser specialised to the signature must accept exactly the formulas the LL(1) parser accepts,
+# and a parser using it must report the same error as the LL(1) parser for the rest
+# It is also called directly, a parser falls back to the LL(1) parser on rejection which would hide false rejections
+def check_specialised(directory):
+    failures = []
+    general = base_parser(directory, build_tree=False)
+    specialised = base_parser(directory, build_tree=False, specialise=True)
+    recognise = specialised.grammar.recogniser()
+    symbols = BASE_VAR + BASE_CONST + BASE_PRED + BASE_EQ + BASE_CONN + BASE_QUAN + list('(),')
+    for _ in range(2000):
+        tokens = random_formula()
+        for _ in range(random.randint(0, 2)): # Delete, insert or replace a few tokens
+            i = random.randrange(len(tokens) + 1)
+            tokens[i:i + random.randint(0, 1)] = random.choices(symbols, k=random.randint(0, 1))
+        got = (specialised.parse(tokens), specialised.syntax_code, specialised.index)
+        want = (general.parse(tokens), general.syntax_code, general.index)
+        length = recognise(tokens)
+        if not got == want or not length == (0 if want[0] else len(tokens)) or not bool(want[0]) == (not is_formula(tokens)):
+            failures.append(f"{' '.join(tokens)} gave {got} specialised, {want} with the LL(1) parser "
+                            f"and {length} from the recogniser")
+    return failures
+
+# Reference evaluation of a formula over the base symbols, trying every element of the domain for each quantifier
+# predicates maps each predicate to an array indexed by its arguments, constants maps each constant to an element
+def brute_force(tokens, size, predicates, constants, env):
+    def term(t, env):
+        return env[t] if t in BASE_VAR else constants[t]
+
+    # Returns the value of the formula starting at i and the index just after it
+    def form(i, env):
+        t = tokens[i]
+        if t in BASE_QUAN:
+            values = [form(i + 2, {**env, tokens[i + 1]: element}) for element in range(size)]
+            holds = [value for value, _ in values]
+            return (any(holds) if t == BASE_QUAN[0] else all(holds)), values[0][1]
+        if t == BASE_CONN[-1]:
+            value, end = form(i + 1, env)
+            return not value, end
+        if t in BASE_PRED:
+            arity = BASE_PRED.index(t) + 1
+            args = tokens[i + 2:i + 2 + 2 * arity:2]
+            return bool(predicates[t][tuple(env[x] for x in args)]), i + 2 + 2 * arity
+        if tokens[i + 1] in BASE_VAR + BASE_CONST:
+            return term(tokens[i + 1], env) == term(tokens[i + 3], env), i + 5
+        left, j = form(i + 1, env)
+        right, end = form(j + 1, env)
+        value = [left and right, left or right, not left or right, left == right][BASE_CONN.index(tokens[j])]
+        return value, end + 1
+
+    return form(0, env)[0]
+
+# Random interpretation of the base symbols over a domain of size elements, drawn with random so --seed repeats it
+def random_model(size):
+    import numpy as np
+    predicates = {}
+    for arity, pred in enumerate(BASE_PRED, 1):
+        values = [random.random() < 0.5 for _ in range(size ** arity)]
+        predicates[pred] = np.array(values, dtype=bool).reshape((size,) * arity)
+    constants = {const: random.randrange(size) for const in BASE_CONST}
+    return predicates, constants
+
+# The evaluator must agree with brute force for every assignment of the free variables,
+# also on long chains of quantifiers that bind the same few variables again and again
+def check_evaluator(directory):
+    import evaluate
+    failures = []
+    body = "( PRED2 ( VAR1 , VAR2 ) AND PRED1 ( VAR3 ) )".split()
+    for _ in range(10):
+        chain = [token for i in range(70) for token in (random.choice(BASE_QUAN), BASE_VAR[i % 2])]
+        parser = base_parser(directory)
+        parser.parse(chain + body)
+        size = random.randint(1, 3)
+        predicates, constants = random_model(size)
+        value = evaluate.compile_formula(parser).evaluate(evaluate.Model(size, predicates, constants))
+        # Only the innermost quantifier of each variable matters, the rest bind nothing the body sees
+        for element in range(size):
+            expected = brute_force(chain[-4:] + body, size, predicates, constants, {"VAR3": element})
+            if not bool(value[element]) == expected:
+                failures.append(f"{' '.join(chain + body)} over {size} elements with VAR3 = {element} "
+                                f"evaluated to {bool(value[element])}")
+                break
+    for _ in range(300):
+        tokens = random_formula()
+        parser = base_parser(directory)
+        parser.parse(tokens)
+        size = random.randint(1, 3)
+        predicates, constants = random_model(size)
+        formula = evaluate.compile_formula(parser)
+        value = formula.evaluate(evaluate.Model(size, predicates, constants))
+        for assignment in itertools.product(range(size), repeat=len(formula.free)):
+            env = dict(zip(formula.free, assignment))
+            if not bool(value[assignment]) == brute_force(tokens, size, predicates, constants, env):
+                failures.append(f"{' '.join(tokens)} over {size} elements with {env} evaluated to {bool(value[assignment])}")
+                break
+    return failures
+
+# Clausal normal form must stay linear on a chain of iffs, which doubles in size if distributed out,
+# and on a one element domain, where every atom is a proposition, be satisfiable exactly when the formula holds
+def check_clausal_form(directory):
+    import normalform
+    failures = []
+    atoms = [["PRED1", "(", var, ")"] for var in BASE_VAR]
+    for k in (1, 2, 5, 20, 100):
+        tokens = atoms[0]
+        for i in range(k):
+            tokens = ["("] + tokens + [BASE_CONN[3]] + atoms[(i + 1) % len(atoms)] + [")"]
+        parser = base_parser(directory)
+        parser.parse(tokens)
+        clauses = normalform.clausal_form(parser)
+        # The outer iff gives two clauses, every inner one two definitions of two clauses each
+        definitions = {atom[1] for clause in clauses for _, atom in clause if not atom[1] in BASE_PRED}
+        if not (len(clauses) == 4 * k - 2 and len(definitions) == 2 * k - 2 and all(2 <= len(c) <= 3 for c in clauses)):
+            failures.append(f"a chain of {k} iffs gave {len(clauses)} clauses of {sorted(set(map(len, clauses)))} "
+                            f"literals with {len(definitions)} definitions, expected {4 * k - 2} clauses of 2 or 3 "
+                            f"literals with {2 * k - 2}")
+
+    for _ in range(200):
+        tokens = random_formula(3)
+        parser = base_parser(directory)
+        parser.parse(tokens)
+        clauses = normalform.clausal_form(parser)
+        predicates, constants = random_model(1)
+        holds = brute_force(tokens, 1, predicates, constants, {var: 0 for var in BASE_VAR})
+        definitions = sorted({atom[1] for clause in clauses for _, atom in clause
+                              if atom[0] == 'pred' and not atom[1] in BASE_PRED})
+        truth = {pred: bool(value.flat[0]) for pred, value in predicates.items()}
+        satisfiable = False
+        for values in itertools.product([False, True], repeat=len(definitions)):
+            truth.update(zip(definitions, values))
+            # Equalities always hold with one element
+            if all(any(positive == (atom[0] == 'eq' or truth[atom[1]]) for positive, atom in clause) for clause in clauses):
+                satisfiable = True
+                break
+        if not satisfiable == holds:
+            failures.append(f"{' '.join(tokens)} {'holds' if holds else 'does not hold'} on one element "
+                            f"but its clauses are {'' if satisfiable else 'not '}satisfiable")
+    return failures
+
+# Positions of the predicate arguments in a formula, an unknown symbol there is recovered from at the next , or )
+def predicate_arguments(tokens):
+    return [i for i in range(2, len(tokens)) if tokens[i] in BASE_VAR
+            and (tokens[i - 1] == "," or tokens[i - 1] == "(" and tokens[i - 2] in BASE_PRED)]
+
+# Two unknown symbols on either side of a connective must both be reported with error recovery,
+# the first exactly as a parse without recovery reports it
+def check_recovery(directory):
+    failures = []
+    for _ in range(500):
+        left, right = random_formula(3), random_formula(3)
+        if not predicate_arguments(left) or not predicate_arguments(right):
+            continue
+        i = random.choice(predicate_arguments(left))
+        j = random.choice(predicate_arguments(right))
+        left[i] = right[j] = "UNKNOWN"
+        tokens = ["("] + left + [BASE_CONN[0]] + right + [")"]
+        first = base_parser(directory, build_tree=False)
+        first.parse(tokens)
+        parser = base_parser(directory, build_tree=False, recover=True)
+        parser.parse(tokens)
+        errors = [error[:2] for error in parser.error_list]
+        expected = [("UNKNOWN_SYMBOL", 1 + i), ("UNKNOWN_SYMBOL", len(left) + 2 + j)]
+        if not (errors == expected and errors[0] == (first.syntax_code, first.index) == (parser.syntax_code, 1 + i)):
+            failures.append(f"{' '.join(tokens)} gave {errors} with recovery and {first.syntax_code} at {first.index} "
+                            f"without, expected {expected}")
+    return failures
+
+# Each error is shown with a bounded number of tokens around it, however long the formula
+def check_error_windows(directory):
+    failures = []
+    tokens = random_formula(2)
+    for _ in range(200):
+        tokens = ["("] + tokens + [BASE_CONN[0]] + random_formula(2) + [")"]
+    bad = sorted(random.sample(predicate_arguments(tokens), 50))
+    for i in bad:
+        tokens[i] = "UNKNOWN"
+    tokens.pop() # The last bracket is missing, so one error is at the end of the formula
+    path = os.path.join(directory, "windows.txt")
+    sub_dict = gen_sub(sub=False)
+    sub_dict["UNKNOWN"] = "UNKNOWN"
+    write_to_file(tokens, sub_dict, path=path)
+    parser = program.PredictiveParser(build_tree=False, recover=True)
+    with redirect_stdout(io.StringIO()):
+        program.parse_file(path, parser)
+    parser.parse(program.formula_tokens(parser))
+    windows = program.error_windows(parser)
+    if not len(windows) == len(parser.error_list) or len(windows) < len(bad):
+        failures.append(f"{len(windows)} windows for {len(parser.error_list)} errors, {len(bad)} symbols are unknown")
+    for (code, index, _, _), (shown, at, cut_before, cut_after) in zip(parser.error_list, windows):
+        expected = tokens[index] if index < len(tokens) else ""
+        if not (0 <= at < len(shown) and shown[at] == expected and len(shown) <= 2 * program.ERROR_CONTEXT + 1
+                and cut_before == (at < index) and cut_after == (index + len(shown) - at < len(tokens))):
+            failures.append(f"{code} at {index} was shown as {' '.join(shown)} with the error at {at}")
+    return failures
+
+# A request line that is valid JSON but not an object must get a FAIL response of its own,
+# and the valid requests either side of it must still be answered
+def check_server(directory):
+    import asyncio
+    import json
+    import server
+
+    base_parser(directory) # Writes checks.txt
+    path = os.path.join(directory, "checks.txt")
+
+    async def exchange(lines):
+        listener = await asyncio.start_server(server.ValidationServer().serve_client, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        writer.write_eof()
+        responses = [json.loads(line) async for line in reader]
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return responses
+
+    failures = []
+    for bad in ['5', 'null', '"id"', '[1, 2]']:
+        lines = [json.dumps({'op': "load", 'path': path, 'id': 1}), bad, json.dumps({'op': "load", 'path': path, 'id': 3})]
+        responses = asyncio.run(exchange(lines))
+        if not ([response.get('status') for response in responses] == ["OK", "FAIL", "OK"]
+                and responses[0].get('id') == 1 and 'id' not in responses[1] and responses[2].get('id') == 3):
+            failures.append(f"{bad} between two loads gave {responses}")
+    return failures
+
+# Checks of the program's Python interface, run after the cases with --in-process
+# Each is (name, attribute the program needs or None, function returning a list of failure messages)
+# A check that cannot import a module it needs (such as numpy) is skipped
+CHECKS = [
+    ("Incremental reparsing", "PredictiveParser.reparse", check_reparse),
+    ("Error recovery", "ParseContext.synchronise", check_recovery),
+    ("Error windows", "error_windows", check_error_windows),
+    ("Specialised recogniser", "specialised_recogniser", check_specialised),
+    ("Finite model evaluation", None, check_evaluator),
+    ("Clausal normal form", None, check_clausal_form),
+    ("Validation server", None, check_server),
+]
+
+# Runs every check the program supports, returns the number that failed
+def run_checks(py_path, directory):
+    if program is None:
+        load_program(py_path)
+    failed = 0
+    for name, needs, check in CHECKS:
+        owner, _, attribute = (needs or '').partition('.')
+        if needs and not hasattr(getattr(program, owner, None), attribute or '__call__'):
+            print(f"-- CHECK: {name} skipped, the program has no {needs} --")
+            continue
+        try:
+            failures = check(directory)
+        except ImportError as e:
+            print(f"-- CHECK: {name} skipped, {e} --")
+            continue
+        print(f"-- CHECK: {name} {'FAILED' if failures else 'passed'} --")
+        for failure in failures[:10]:
+            print(failure)
+        failed += bool(failures)
+    return failed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Test a Compiler Design Summative program.")
+    arg_parser.add_argument('program', help="Path to the program to test")
+    arg_parser.add_argument('--in-process', action='store_true',
+                            help="Call the program's parse_file and PredictiveParser directly, in parallel")
+    arg_parser.add_argument('--jobs', type=int, default=0,
+                            help="Worker processes for --in-process (0 for one per core, default: 0)")
+    arg_parser.add_argument('--seed', type=int, help="Seed for the random cases, to repeat a run")
+    args = arg_parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        cases = gen_cases(directory)
+        if not args.in_process:
+            run_subprocesses(args.program, cases)
+            return
+        unexpected = run_in_processes(args.program, cases, args.jobs)
+        if run_checks(args.program, directory) or unexpected:
+            sys.exit(1)
 
 if __name__ == '__main__':
     main()